@@ -0,0 +1,322 @@
+import time
+import threading
+import concurrent.futures
+import chess.engine
+from openings import check_openings, check_openings_by_position, get_user_moves
+from gm_database import fetch_gm_data, process_gm_data
+from engines import analyse_engine_lines, STOCKFISH_PATH, KOMODO_PATH
+from endgame import probe_endgame, count_pieces, MAX_TABLEBASE_PIECES
+from sapientia_engine import search_sapientia
+from tracing import current_trace, use_trace
+
+# Seconds each source may take before it is reported as timed out
+SOURCE_TIMEOUTS = {
+    "gm": 5.0,
+    "stockfish": 10.0,
+    "komodo": 10.0,
+    "sapientia": 5.0,
+    "tablebase": 5.0,
+    "openings": 2.0,
+}
+
+# Seconds the in-process Sapientia engine searches before returning its best move so far
+SAPIENTIA_TIME_LIMIT = 3.0
+
+# Sources that search under the engine limit; they are stopped when they pass their cutoff
+ENGINE_SOURCES = ("stockfish", "komodo", "sapientia")
+
+# Seconds an engine source may exceed a time limit (process checkout, UCI round trip)
+# before it is reported as timed out
+ENGINE_TIMEOUT_MARGIN = 0.5
+
+# Seconds an engine source without a time limit waits for a free pooled engine
+ENGINE_CHECKOUT_TIMEOUT = 10.0
+
+# Seconds after which the whole analysis returns, whatever is still running
+OVERALL_DEADLINE = 12.0
+
+# Placeholder shown in the analysis table for a source that did not answer in time
+TIMED_OUT = "Timed out"
+
+# Seconds between checks of the cancel event while waiting for sources
+CANCEL_POLL_INTERVAL = 0.05
+
+
+def fetch_gm_source(fen, board, limit, progress=None, cancel_event=None, game=None):
+    """Best move and top games from the Lichess masters explorer."""
+    data = fetch_gm_data(fen)
+    if not data:
+        # The explorer answers every position, if only with empty lists; nothing means it failed
+        raise RuntimeError("GM explorer unavailable")
+    best_move_uci, _, _, _, top_games = process_gm_data(data)
+    return {"best_move_uci": best_move_uci, "top_games": top_games}
+
+
+def format_engine_lines(lines):
+    """Format MultiPV lines as "e2e4 +0.30 (depth 12); d2d4 +0.25; ..." with scores for the side to move."""
+    parts = []
+    for line in lines:
+        if line["mate"] is not None:
+            text = f"{line['move']} #{line['mate']}"
+        elif line["score"] is not None:
+            text = f"{line['move']} {line['score'] / 100:+.2f}"
+        else:
+            text = line["move"]
+        if line["multipv"] == 1:
+            text += f" (depth {line['depth']})"
+        parts.append(text)
+    return "; ".join(parts)
+
+
+def fetch_engine_source(fen, engine_path, key, limit, progress=None, cancel_event=None, game=None):
+    """
+    MultiPV lines from a UCI engine, streamed through `progress` as they deepen and stopped by `cancel_event`.
+
+    Engine errors propagate, so `run_analysis` reports them without caching a placeholder.
+
+    `game` identifies the game the position belongs to; the pooled engine gets
+    "ucinewgame" whenever it differs from the game of its previous search.
+    """
+    on_update = None
+    if progress is not None:
+        on_update = lambda lines: progress({key: format_engine_lines(lines)})
+    # Waiting longer for an engine than the source may take would only start a search nobody reads
+    checkout_timeout = limit.time + ENGINE_TIMEOUT_MARGIN if limit.time is not None else ENGINE_CHECKOUT_TIMEOUT
+    lines = analyse_engine_lines(fen, engine_path, depth=limit.depth, time_limit=limit.time, game=game,
+                                 on_update=on_update, stop_event=cancel_event, checkout_timeout=checkout_timeout)
+    return {key: format_engine_lines(lines) if lines else "No best move available"}
+
+
+def fetch_stockfish_source(fen, board, limit, progress=None, cancel_event=None, game=None):
+    """Best moves from Stockfish."""
+    return fetch_engine_source(fen, STOCKFISH_PATH, "best_move_stockfish", limit, progress, cancel_event, game)
+
+
+def fetch_komodo_source(fen, board, limit, progress=None, cancel_event=None, game=None):
+    """Best moves from Komodo."""
+    return fetch_engine_source(fen, KOMODO_PATH, "best_move_komodo", limit, progress, cancel_event, game)
+
+
+def fetch_sapientia_source(fen, board, limit, progress=None, cancel_event=None, game=None):
+    """Best move from the in-process Sapientia engine, with its search depth and speed."""
+    time_limit = limit.time if limit.time is not None else SAPIENTIA_TIME_LIMIT
+    result = search_sapientia(fen, depth=limit.depth, time_limit=time_limit, stop_event=cancel_event)
+    if result["move"] is None:
+        return {"best_move_sapientia": "No best move available"}
+    return {"best_move_sapientia": f"{result['move']} (depth {result['depth']}, {result['nps']} nps)"}
+
+
+def fetch_tablebase_source(fen, board, limit, progress=None, cancel_event=None, game=None):
+    """Best endgame move, WDL and DTZ from a single Syzygy tablebase probe."""
+    endgame_data = probe_endgame(fen) or {}
+    # Too many pieces is a final answer; any other error is a failed probe worth retrying
+    if "Error" in endgame_data or not endgame_data:
+        if count_pieces(fen) <= MAX_TABLEBASE_PIECES:
+            raise RuntimeError(endgame_data.get("Error", "No tablebase backend configured"))
+    return {
+        "best_move_syzygy": endgame_data.get("best_move") or "No endgame move available",
+        "wdl": endgame_data.get("WDL", "N/A"),
+        "dtz": endgame_data.get("DTZ", "N/A"),
+    }
+
+
+def fetch_openings_source(fen, board, limit, progress=None, cancel_event=None, game=None):
+    """Openings from the Lichess dataset matching the moves played so far, or reached by transposition."""
+    matches = check_openings(get_user_moves(board))
+    matches += [match for match in check_openings_by_position(board) if match not in matches]
+    return {"opening_matches": matches}
+
+
+def position_only(board, limit):
+    """Cache parameters for sources that depend on the position alone."""
+    return ()
+
+
+def engine_limit(board, limit):
+    """Cache parameters for engine sources, whose result depends on the search depth and time."""
+    return (limit.depth, limit.time)
+
+
+def move_sequence(board, limit):
+    """Cache parameters for the openings source, which depends on the moves played."""
+    return (get_user_moves(board),)
+
+
+# Every source of the analysis table, with the result keys it fills in and
+# the parameters (besides the position) its cached result depends on
+ANALYSIS_SOURCES = {
+    "gm": (fetch_gm_source, ("best_move_uci", "top_games"), position_only),
+    "stockfish": (fetch_stockfish_source, ("best_move_stockfish",), engine_limit),
+    "komodo": (fetch_komodo_source, ("best_move_komodo",), engine_limit),
+    "sapientia": (fetch_sapientia_source, ("best_move_sapientia",), engine_limit),
+    "tablebase": (fetch_tablebase_source, ("best_move_syzygy", "wdl", "dtz"), position_only),
+    "openings": (fetch_openings_source, ("opening_matches",), move_sequence),
+}
+
+
+def run_analysis(board, limit, executor, source_timeouts=None, deadline=OVERALL_DEADLINE,
+                 on_result=None, cancel_event=None, cache=None, trace=None, game=None):
+    """
+    Query every analysis source for a position concurrently.
+
+    Args:
+        board (chess.Board): The position to analyse, including its move stack.
+        limit (chess.engine.Limit): Depth and/or time limit for the engines; an int is
+            taken as a depth. With a time limit, engines return their best move so far
+            when it runs out, and their timeouts are derived from it.
+        executor (concurrent.futures.Executor): Pool the sources run on.
+        source_timeouts (dict): Per-source timeouts in seconds, overriding SOURCE_TIMEOUTS.
+        deadline (float): Seconds after which all unfinished sources are abandoned.
+            Engine searches past their cutoff are stopped, so their engines go back
+            to the pool; their partial results are not cached.
+        on_result (callable): Called as `on_result(name, partial_data)` whenever a source
+            finishes, times out or (for engines) reports a deeper intermediate result,
+            so callers can show results progressively. It may be called from worker threads.
+        cancel_event (threading.Event): When set, sources that have not started yet are
+            cancelled, engine searches stop early, and the analysis returns immediately.
+            Results of sources that return after it is set are neither reported nor cached.
+        cache (cache.AnalysisCache): Per-source cache consulted before querying a source
+            and filled with every result that arrives in time. Sources that fail raise,
+            and their "N/A" placeholders are never cached.
+        trace (tracing.Trace): Trace that records a span per source (with its cache
+            result and outcome) and the stages inside the sources; defaults to the
+            current trace of the calling thread, if any.
+        game (object): Key of the game the position belongs to (e.g. one per GUI
+            game); pooled engines get "ucinewgame" when it changes, so their hash
+            tables are not reused across unrelated games.
+
+    Returns:
+        dict: The analysis data. Sources that were late have their keys set to
+        TIMED_OUT and are listed under "timed_out"; "cancelled" is True if the
+        analysis was abandoned through `cancel_event`; "elapsed" is the wall time
+        in seconds.
+    """
+    if isinstance(limit, int):
+        limit = chess.engine.Limit(depth=limit)
+    fen = board.fen()
+    board = board.copy()
+    timeouts = dict(SOURCE_TIMEOUTS)
+    if limit.time is not None:
+        timeouts.update({name: limit.time + ENGINE_TIMEOUT_MARGIN for name in ENGINE_SOURCES})
+    timeouts.update(source_timeouts or {})
+    start = time.monotonic()
+    trace = trace if trace is not None else current_trace()
+    trace_start = time.perf_counter()
+
+    data = {"timed_out": [], "cancelled": False}
+    finished = set()
+    report_lock = threading.Lock()
+
+    def report(name, partial, final=True):
+        # Intermediate results are dropped once a source has finished or timed out
+        with report_lock:
+            if name in finished:
+                return
+            if final:
+                finished.add(name)
+            data.update(partial)
+        if on_result is not None:
+            on_result(name, partial)
+
+    def run_source(name, fetch, *args):
+        # A source that returns once its stop event is set may have stopped its search
+        # early, so its result is flagged as partial: it is neither reported nor cached
+        partial = fetch(*args)
+        return partial, stop_events[name].is_set()
+
+    def traced_fetch(name, fetch, *args):
+        # Runs on a worker thread; the stages inside the source join the same trace
+        cache_args = {"cache": "miss"} if cache is not None else {}
+        with use_trace(trace), trace.span(f"source.{name}", **cache_args) as span_args:
+            partial, stopped = run_source(name, fetch, *args)
+            if stopped:
+                span_args["outcome"] = "cancelled"
+            elif name in data["timed_out"]:
+                span_args["outcome"] = "late"
+            return partial, stopped
+
+    def cache_late(late, name, params):
+        # The late result of a source that cannot be stopped (e.g. HTTP) still warms the cache
+        if late.cancelled() or late.exception() is not None:
+            return
+        partial, stopped = late.result()
+        if not stopped:
+            cache.put(board, name, partial, params)
+
+    futures = {}
+    cutoffs = {}
+    # Each source gets its own stop event, set when the analysis is cancelled or, for
+    # engines, when the source passes its cutoff, so the search frees its engine
+    stop_events = {name: threading.Event() for name in ANALYSIS_SOURCES}
+    for name, (fetch, _, cache_params) in ANALYSIS_SOURCES.items():
+        if cache is not None:
+            cached = cache.get(board, name, cache_params(board, limit))
+            if cached is not None:
+                if trace is not None:
+                    now = time.perf_counter()
+                    trace.add_span(f"source.{name}", now, now, cache="hit", outcome="ok")
+                report(name, cached)
+                continue
+        progress = lambda partial, name=name: report(name, partial, final=False)
+        future = executor.submit(traced_fetch if trace is not None else run_source,
+                                 name, fetch, fen, board, limit, progress, stop_events[name], game)
+        futures[future] = name
+        cutoffs[future] = start + min(timeouts.get(name, deadline), deadline)
+
+    pending = set(futures)
+    while pending:
+        if cancel_event is not None and cancel_event.is_set():
+            for future in pending:
+                stop_events[futures[future]].set()
+                future.cancel()
+            with report_lock:
+                finished.update(futures[future] for future in pending)
+            data["cancelled"] = True
+            break
+
+        wait_time = max(0.0, min(cutoffs[future] for future in pending) - time.monotonic())
+        if cancel_event is not None:
+            wait_time = min(wait_time, CANCEL_POLL_INTERVAL)
+        done, pending = concurrent.futures.wait(
+            pending, timeout=wait_time, return_when=concurrent.futures.FIRST_COMPLETED)
+
+        for future in done:
+            name = futures[future]
+            try:
+                partial, stopped = future.result()
+            except Exception as e:
+                # Failures are shown but not cached, so the next request asks the source again
+                print(f"Error while fetching {name} analysis: {e}")
+                partial = {key: "N/A" for key in ANALYSIS_SOURCES[name][1]}
+            else:
+                if stopped:
+                    # Cut short by the cancel event (sources past their cutoff are no longer
+                    # pending); the next pass of the loop abandons the rest
+                    with report_lock:
+                        finished.add(name)
+                    data["cancelled"] = True
+                    continue
+                if cache is not None:
+                    cache.put(board, name, partial, ANALYSIS_SOURCES[name][2](board, limit))
+            report(name, partial)
+
+        # Give up on sources that are past their cutoff: engine searches are stopped, other
+        # sources finish in the background
+        now = time.monotonic()
+        for future in [future for future in pending if cutoffs[future] <= now]:
+            future.cancel()
+            pending.discard(future)
+            name = futures[future]
+            if name in ENGINE_SOURCES:
+                stop_events[name].set()
+            if cache is not None:
+                params = ANALYSIS_SOURCES[name][2](board, limit)
+                future.add_done_callback(lambda late, name=name, params=params: cache_late(late, name, params))
+            data["timed_out"].append(name)
+            report(name, {key: TIMED_OUT for key in ANALYSIS_SOURCES[name][1]})
+
+    data["elapsed"] = time.monotonic() - start
+    if trace is not None:
+        outcome = "cancelled" if data["cancelled"] else "timeout" if data["timed_out"] else "ok"
+        trace.add_span("analysis", trace_start, time.perf_counter(), outcome=outcome)
+    return data
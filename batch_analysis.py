@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import argparse
+import concurrent.futures
+import chess
+import chess.pgn
+from openings import check_openings_by_position
+from evaluation import evaluate
+from engines import analyse_engine_lines, STOCKFISH_PATH, KOMODO_PATH
+from endgame import probe_endgame, count_pieces, MAX_TABLEBASE_PIECES
+from sapientia_engine import search_sapientia
+
+# Seconds each engine searches a position when no depth is given
+DEFAULT_TIME_LIMIT = 1.0
+
+# Positions queued per worker process, so games are streamed rather than read up front
+PENDING_PER_WORKER = 4
+
+# Engines analysed by default, with the path of their UCI binary (None for in-process)
+DEFAULT_ENGINES = {"stockfish": STOCKFISH_PATH, "komodo": KOMODO_PATH, "sapientia": None}
+
+
+def stream_positions(pgn_paths, max_plies=None):
+    """
+    Yield (fen, epd, game, ply) for every mainline position of the games in PGN files.
+
+    `game` numbers the games across all files, and `ply` counts the moves played
+    (0 is the starting position). Only the first `max_plies` moves of each game
+    are followed when it is given.
+    """
+    game_number = 0
+    for path in pgn_paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            while True:
+                game = chess.pgn.read_game(f)
+                if game is None:
+                    break
+                board = game.board()
+                yield board.fen(), board.epd(), game_number, 0
+                for ply, move in enumerate(game.mainline_moves(), start=1):
+                    if max_plies is not None and ply > max_plies:
+                        break
+                    board.push(move)
+                    yield board.fen(), board.epd(), game_number, ply
+                game_number += 1
+
+
+def analyse_position(fen, engines=None, depth=None, time_limit=DEFAULT_TIME_LIMIT, game=None):
+    """
+    Collect the data of the GUI's analysis table for one position.
+
+    Runs in a worker process; engine processes stay warm in that process's pool.
+
+    Args:
+        fen (str): The position in FEN notation.
+        engines (dict): Engine name -> UCI binary path, or None for the in-process Sapientia engine.
+        depth (int): Search depth for every engine; overrides `time_limit`.
+        time_limit (float): Seconds each engine searches.
+        game (object): Key of the game the position comes from; engines get "ucinewgame" when it changes.
+
+    Returns:
+        dict: "opening_matches", "evaluation" (Sapientia terms, see `evaluation.evaluate`),
+        one {"move", "score", "mate", "depth"} entry per engine (None if it failed or
+        there is no legal move) and "tablebase" ({"best_move", "wdl", "dtz"} or None).
+    """
+    if engines is None:
+        engines = DEFAULT_ENGINES
+    if depth is not None:
+        time_limit = None
+    board = chess.Board(fen)
+    record = {
+        "opening_matches": [list(match) for match in check_openings_by_position(board)],
+        "evaluation": evaluate(board),
+    }
+
+    game_over = board.is_game_over()
+    for name, path in engines.items():
+        record[name] = None
+        if game_over:
+            continue
+        try:
+            if path is None:
+                result = search_sapientia(fen, depth=depth, time_limit=time_limit)
+                record[name] = {"move": result["move"], "score": result["score"], "mate": None, "depth": result["depth"]}
+            else:
+                lines = analyse_engine_lines(fen, path, multipv=1, depth=depth, time_limit=time_limit, game=game)
+                if lines:
+                    record[name] = {key: lines[0][key] for key in ("move", "score", "mate", "depth")}
+        except Exception as e:
+            print(f"Error while analysing {fen} with {name}: {e}", file=sys.stderr)
+
+    record["tablebase"] = None
+    if count_pieces(fen) <= MAX_TABLEBASE_PIECES:
+        endgame_data = probe_endgame(fen)
+        if "Error" not in endgame_data:
+            record["tablebase"] = {key.lower(): endgame_data[key] for key in ("best_move", "WDL", "DTZ")}
+    return record
+
+
+def load_finished(output):
+    """
+    Return the EPDs already written to a JSONL output, for resuming.
+
+    A last line cut short by an interruption is removed, so appending continues
+    on a clean line.
+    """
+    finished = set()
+    if not os.path.exists(output):
+        return finished
+    with open(output, "rb+") as f:
+        end = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                finished.add(json.loads(line)["epd"])
+            except (ValueError, KeyError):
+                break
+            end += len(line)
+        f.truncate(end)
+    return finished
+
+
+def run_batch(pgn_paths, output, engines=None, depth=None, time_limit=DEFAULT_TIME_LIMIT,
+              max_plies=None, workers=None, resume=True):
+    """
+    Analyse every distinct position of PGN files on a process pool and write one JSON line per position.
+
+    Positions are deduplicated by EPD, so transpositions and repeated openings are
+    analysed once. Each line holds "fen", "epd", the first "game" and "ply" the
+    position occurred at, and the fields of `analyse_position`; lines are written
+    as positions finish, in completion order. With `resume`, positions already in
+    `output` are skipped and new lines are appended.
+
+    Args:
+        pgn_paths (list): PGN files to read.
+        output (str): JSONL file to write.
+        engines (dict): Engines to run, see `analyse_position`.
+        depth (int): Search depth; overrides `time_limit`.
+        time_limit (float): Seconds each engine searches.
+        max_plies (int): Number of moves of each game to follow.
+        workers (int): Worker processes (default: one per core).
+        resume (bool): Skip positions already in `output` instead of overwriting it.
+
+    Returns:
+        dict: Number of positions "analysed", "skipped" (already in the output) and "duplicates".
+    """
+    workers = workers or os.cpu_count() or 1
+    seen = load_finished(output) if resume else set()
+    counts = {"analysed": 0, "skipped": len(seen), "duplicates": 0}
+    skipped = set(seen)
+
+    with open(output, "a" if resume else "w", encoding="utf-8") as out, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+
+        def write_finished(return_when):
+            done, _ = concurrent.futures.wait(pending, return_when=return_when)
+            for future in done:
+                record = pending.pop(future)
+                try:
+                    record.update(future.result())
+                except Exception as e:
+                    print(f"Error while analysing {record['fen']}: {e}", file=sys.stderr)
+                    continue
+                out.write(json.dumps(record, separators=(",", ":")) + "\n")
+                out.flush()
+                counts["analysed"] += 1
+
+        for fen, epd, game, ply in stream_positions(pgn_paths, max_plies):
+            if epd in seen:
+                if epd not in skipped:
+                    counts["duplicates"] += 1
+                continue
+            seen.add(epd)
+            future = executor.submit(analyse_position, fen, engines, depth, time_limit, ("game", game))
+            pending[future] = {"fen": fen, "epd": epd, "game": game, "ply": ply}
+            if len(pending) >= workers * PENDING_PER_WORKER:
+                write_finished(concurrent.futures.FIRST_COMPLETED)
+        if pending:
+            write_finished(concurrent.futures.ALL_COMPLETED)
+    return counts
+
+
+def write_parquet(jsonl_path, parquet_path):
+    """Convert a JSONL output to Parquet. Needs the `pyarrow` package."""
+    import pyarrow.json
+    import pyarrow.parquet
+
+    pyarrow.parquet.write_table(pyarrow.json.read_json(jsonl_path), parquet_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Annotate every position of PGN files with the Sapientia analysis.")
+    parser.add_argument("pgn", nargs="+", help="PGN files to analyse")
+    parser.add_argument("--output", required=True, help="JSONL file to write; an existing file is resumed")
+    parser.add_argument("--parquet", help="Also convert the results to this Parquet file when done")
+    parser.add_argument("--engines", nargs="+", choices=sorted(DEFAULT_ENGINES), default=list(DEFAULT_ENGINES),
+                        help="Engines to run")
+    parser.add_argument("--stockfish-path", default=STOCKFISH_PATH, help="Path of the Stockfish binary")
+    parser.add_argument("--komodo-path", default=KOMODO_PATH, help="Path of the Komodo binary")
+    parser.add_argument("--depth", type=int, help="Search depth (overrides --time)")
+    parser.add_argument("--time", type=float, default=DEFAULT_TIME_LIMIT, help="Seconds per engine and position")
+    parser.add_argument("--max-plies", type=int, help="Moves of each game to follow")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per core)")
+    parser.add_argument("--restart", action="store_true", help="Overwrite the output instead of resuming")
+    args = parser.parse_args(argv)
+
+    paths = {"stockfish": args.stockfish_path, "komodo": args.komodo_path, "sapientia": None}
+    engines = {}
+    for name in args.engines:
+        if paths[name] is not None and not os.path.exists(paths[name]):
+            print(f"Skipping {name}: {paths[name]} not found", file=sys.stderr)
+            continue
+        engines[name] = paths[name]
+
+    counts = run_batch(args.pgn, args.output, engines=engines, depth=args.depth, time_limit=args.time,
+                       max_plies=args.max_plies, workers=args.workers, resume=not args.restart)
+    print(f"Analysed {counts['analysed']} positions ({counts['skipped']} already done, "
+          f"{counts['duplicates']} duplicates) into {args.output}")
+    if args.parquet:
+        write_parquet(args.output, args.parquet)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import csv
+import sys
+import chess
+import numpy as np
+from evaluation import PIECE_VALUES, PIECE_SQUARE_VALUES
+
+# Number of positions read and scored at a time when streaming a file
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Piece codes used in the encoded boards: 0 is an empty square,
+# 1-6 White pawn..king and 7-12 Black pawn..king
+PIECE_CODES = {
+    symbol: chess.Piece.from_symbol(symbol).piece_type + (0 if symbol.isupper() else 6)
+    for symbol in "PNBRQKpnbrqk"
+}
+
+# Material of each piece code from White's point of view
+MATERIAL_BY_CODE = np.zeros(13, dtype=np.int32)
+# Piece-square value of each piece code on each square, from White's point of view
+POSITION_BY_CODE = np.zeros((13, 64), dtype=np.int32)
+for _piece_type in chess.PIECE_TYPES:
+    for _color, _offset, _sign in ((chess.WHITE, 0, 1), (chess.BLACK, 6, -1)):
+        MATERIAL_BY_CODE[_piece_type + _offset] = _sign * PIECE_VALUES[_piece_type]
+        POSITION_BY_CODE[_piece_type + _offset] = _sign * np.array(PIECE_SQUARE_VALUES[_color][_piece_type])
+
+_SQUARE_INDEX = np.arange(64)
+
+
+def encode_board(placement, out):
+    """Write the piece codes of a FEN piece placement into a 64-entry array, indexed by square."""
+    square = 56
+    for char in placement:
+        if char == "/":
+            square -= 16
+        elif char.isdigit():
+            square += int(char)
+        else:
+            out[square] = PIECE_CODES[char]
+            square += 1
+
+
+def placement_error(placement):
+    """Return why a FEN piece placement cannot be encoded, or None if it is valid."""
+    ranks = placement.split("/")
+    if len(ranks) != 8:
+        return f"expected 8 ranks, found {len(ranks)}"
+    for rank in ranks:
+        width = 0
+        for char in rank:
+            if char in "12345678":
+                width += int(char)
+            elif char in PIECE_CODES:
+                width += 1
+            else:
+                return f"invalid character {char!r} in the piece placement"
+        if width != 8:
+            return f"rank {rank!r} is {width} squares wide"
+    return None
+
+
+def encode_fens(fens):
+    """
+    Encode FEN or EPD strings into an (n, 64) array of piece codes.
+
+    Only the piece placement (the first field) is used; it must be valid (see `placement_error`).
+    """
+    boards = np.zeros((len(fens), 64), dtype=np.int8)
+    for row, fen in zip(boards, fens):
+        encode_board(fen.split(None, 1)[0], row)
+    return boards
+
+
+def evaluate_encoded(boards):
+    """
+    Score encoded boards with the Sapientia material and piece-square terms.
+
+    Returns:
+        dict: "material", "position" and "total" arrays of centipawn scores, from White's point of view.
+    """
+    material = MATERIAL_BY_CODE[boards].sum(axis=1)
+    position = POSITION_BY_CODE[boards, _SQUARE_INDEX].sum(axis=1)
+    return {"material": material, "position": position, "total": material + position}
+
+
+def evaluate_batch(fens):
+    """Score a list of FEN/EPD strings; see `evaluate_encoded`."""
+    return evaluate_encoded(encode_fens(fens))
+
+
+def stream_fens(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield lists of up to `chunk_size` FEN/EPD lines from a file.
+
+    Blank lines and "#" comments are skipped; so are lines whose piece placement
+    is invalid, which are reported on stderr.
+    """
+    chunk = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            error = placement_error(line.split(None, 1)[0])
+            if error is not None:
+                print(f"Skipping line {number} of {path}: {error}", file=sys.stderr)
+                continue
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def evaluate_file(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield (fens, scores) for each chunk of a FEN/EPD file, so memory use stays flat."""
+    for fens in stream_fens(path, chunk_size):
+        yield fens, evaluate_batch(fens)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a FEN/EPD file with the Sapientia material and piece-square terms.")
+    parser.add_argument("input", help="File with one FEN or EPD per line")
+    parser.add_argument("--output", help="CSV file to write (default: standard output)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Positions scored per batch")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        writer = csv.writer(output)
+        writer.writerow(["fen", "material", "position", "total"])
+        for fens, scores in evaluate_file(args.input, args.chunk_size):
+            writer.writerows(zip(fens, scores["material"].tolist(), scores["position"].tolist(), scores["total"].tolist()))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import threading
+import concurrent.futures
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import chess
+import chess.engine
+import gm_database
+import endgame
+import openings
+import store
+from evaluation import EVALUATION_TERMS, evaluate, count_mobility, count_legal_mobility
+from openings import OpeningIndex, OPENINGS_ARTIFACT, load_openings
+from engines import EnginePool, STOCKFISH_PATH, KOMODO_PATH
+from sapientia_engine import SapientiaEngine, TranspositionTable
+from store import AnalysisStore
+from cache import AnalysisCache
+from analysis import run_analysis
+from tracing import Trace, use_trace
+
+# Fixed corpus of positions the benchmarks run on
+BENCHMARK_POSITIONS = {
+    "opening": [
+        chess.STARTING_FEN,
+        "rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq c6 0 2",
+        "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+        "rnbqkb1r/pp2pppp/3p1n2/8/3NP3/8/PPP2PPP/RNBQKB1R w KQkq - 1 5",
+    ],
+    "middlegame": [
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        "r2q1rk1/ppp2ppp/2np1n2/2b1p1B1/2B1P1b1/2NP1N2/PPP2PPP/R2Q1RK1 w - - 0 8",
+        "2rq1rk1/pb1nbppp/1p2pn2/2pp4/3P4/1P1BPN2/PBPN1PPP/R2QR1K1 w - - 0 11",
+        "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R1BQKB1R w KQ - 0 8",
+    ],
+    "endgame": [
+        "8/8/8/4k3/8/8/4P3/4K3 w - - 0 1",
+        "8/8/4k3/8/8/3QK3/8/8 w - - 0 1",
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1",
+    ],
+}
+
+# Seconds each throughput measurement runs for, at least
+MIN_MEASURE_TIME = 0.5
+
+# Repetitions of each measurement; the best one is kept to reduce noise
+REPEAT = 3
+
+# Search depth of the engine and Sapientia benchmarks
+BENCH_DEPTH = 8
+SAPIENTIA_BENCH_DEPTH = 4
+
+# Engine time limit of the end-to-end analysis benchmark, in seconds
+END_TO_END_TIME_LIMIT = 0.5
+
+# Code path the end-to-end benchmark times, reported with its metrics
+END_TO_END_PATH = ("analysis.run_analysis with a per-position game key and trace, as ChessGUI.fetch_and_process "
+                   "calls it, without the widgets")
+
+# Relative change that counts as a regression when comparing with a baseline
+DEFAULT_THRESHOLD = 0.10
+
+# Seed and number of random games whose positions form the mobility reference set
+MOBILITY_REFERENCE_SEED = 20240101
+MOBILITY_REFERENCE_GAMES = 200
+MOBILITY_REFERENCE_PLIES = 120
+
+# Seed and size of the stand-in openings table, used when no openings artifact exists
+STAND_IN_SEED = 20240101
+STAND_IN_OPENINGS = 3000
+
+
+def corpus():
+    """Return every corpus position as (phase, fen)."""
+    return [(phase, fen) for phase, fens in BENCHMARK_POSITIONS.items() for fen in fens]
+
+
+def measure(func, min_time=MIN_MEASURE_TIME, repeat=REPEAT):
+    """
+    Time a callable.
+
+    Returns:
+        float: Best seconds per call over `repeat` runs, each calling `func` for at least `min_time` seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            func()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        per_call = elapsed / calls
+        best = per_call if best is None else min(best, per_call)
+    return best
+
+
+def metric(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def stand_in_openings(count=STAND_IN_OPENINGS, seed=STAND_IN_SEED):
+    """Return a deterministic openings table of random lines, shaped like the Lichess dataset."""
+    rng = random.Random(seed)
+    entries = []
+    for number in range(count):
+        board = chess.Board()
+        for _ in range(rng.randint(1, 16)):
+            moves = sorted(board.legal_moves, key=lambda move: move.uci())
+            if not moves:
+                break
+            board.push(rng.choice(moves[:6]))
+        uci = " ".join(move.uci() for move in board.move_stack)
+        entries.append({"eco": "A00", "name": f"Stand-in {number}", "uci": uci, "epd": board.epd()})
+    return entries
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the Lichess explorer and tablebase APIs, with canned answers."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        fen = parse_qs(url.query).get("fen", [chess.STARTING_FEN])[0].replace("_", " ")
+        board = chess.Board(fen)
+        moves = sorted(move.uci() for move in board.legal_moves)
+        if url.path.startswith("/tablebase"):
+            data = {"category": "draw", "dtz": 0, "moves": [{"uci": move} for move in moves]}
+        else:
+            data = {
+                "moves": [{"uci": move, "white": 10 - i, "draws": 5, "black": i} for i, move in enumerate(moves[:5])],
+                "topGames": [{"id": "standin", "white": {"name": "White Player"}, "black": {"name": "Black Player"},
+                              "year": 2000, "winner": "white"}],
+            }
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def local_stand_ins():
+    """
+    Point the GM explorer and the tablebase at a local HTTP stand-in for the enclosed block.
+
+    The explorer cache and the default analysis store live in a temporary directory
+    for the block, so benchmark runs neither read nor fill the user's caches.
+    Without an openings artifact, the stand-in openings table is used as well, so nothing is downloaded.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    directory = tempfile.TemporaryDirectory()
+    saved = gm_database._explorer_client, endgame.tablebase_backends, openings._opening_index, store._default_store
+    explorer_cache = gm_database.ExplorerCache(os.path.join(directory.name, "explorer.sqlite3"))
+    gm_database._explorer_client = gm_database.ExplorerClient(url=f"{base}/explorer", cache=explorer_cache)
+    endgame.tablebase_backends = [endgame.HttpTablebaseBackend(url=f"{base}/tablebase")]
+    store._default_store = AnalysisStore(os.path.join(directory.name, "analysis.sqlite3"))
+    if not os.path.exists(OPENINGS_ARTIFACT):
+        openings._opening_index = OpeningIndex(stand_in_openings(), normalized_epd=True)
+    try:
+        yield base
+    finally:
+        gm_database._explorer_client.close()
+        explorer_cache.close()
+        store._default_store.close()
+        gm_database._explorer_client, endgame.tablebase_backends, openings._opening_index, store._default_store = saved
+        server.shutdown()
+        server.server_close()
+        directory.cleanup()
+
+
+def bench_evaluation():
+    """Evaluations per second of each Sapientia term, and of the full evaluation, over the corpus."""
+    boards = [chess.Board(fen) for _, fen in corpus()]
+    results = {}
+    for name, term in EVALUATION_TERMS.items():
+        per_call = measure(lambda: [term(board) for board in boards])
+        results[f"evaluation.{name}.evals_per_sec"] = metric(len(boards) / per_call, "evals/s", True)
+    per_call = measure(lambda: [evaluate(board) for board in boards])
+    results["evaluation.total.evals_per_sec"] = metric(len(boards) / per_call, "evals/s", True)
+    return results
+
+
+def mobility_reference_positions(games=MOBILITY_REFERENCE_GAMES, plies=MOBILITY_REFERENCE_PLIES,
+                                 seed=MOBILITY_REFERENCE_SEED):
+    """Return the positions of deterministic random games, the reference set for the mobility verdict."""
+    rng = random.Random(seed)
+    boards = []
+    for _ in range(games):
+        board = chess.Board()
+        for _ in range(plies):
+            if board.is_game_over():
+                break
+            board.push(rng.choice(sorted(board.legal_moves, key=lambda move: move.uci())))
+            boards.append(board.copy(stack=False))
+    return boards
+
+
+def check_mobility_verdicts(boards):
+    """
+    Compare the mobility verdict (who has more moves) of `count_mobility` with that of the legal move counts.
+
+    Returns:
+        dict: "positions", "agreement" (fraction with the same verdict) and "check_agreement" (the same, in check).
+    """
+    def sign(counts):
+        return (counts[0] > counts[1]) - (counts[0] < counts[1])
+
+    agree = in_check = check_agree = 0
+    for board in boards:
+        same = sign(count_mobility(board)) == sign(count_legal_mobility(board))
+        agree += same
+        if board.is_check():
+            in_check += 1
+            check_agree += same
+    return {
+        "positions": len(boards),
+        "agreement": agree / len(boards) if boards else 1.0,
+        "check_agreement": check_agree / in_check if in_check else 1.0,
+    }
+
+
+def bench_mobility_reference():
+    """Agreement of the attack-mask mobility verdict with the legal-move verdict on the reference set."""
+    check = check_mobility_verdicts(mobility_reference_positions())
+    return {
+        "evaluation.mobility.verdict_agreement": metric(100 * check["agreement"], "%", True),
+        "evaluation.mobility.check_verdict_agreement": metric(100 * check["check_agreement"], "%", True),
+    }
+
+
+def bench_openings():
+    """Opening lookups per second, by move sequence and by position."""
+    if os.path.exists(OPENINGS_ARTIFACT):
+        entries, source = load_openings(), "artifact"
+    else:
+        entries, source = stand_in_openings(), "stand-in"
+    start = time.perf_counter()
+    index = OpeningIndex(entries, normalized_epd=True)
+    build_time = time.perf_counter() - start
+
+    sequences = [entry["uci"] for entry in entries[::max(1, len(entries) // 200)]]
+    boards = []
+    for sequence in sequences:
+        board = chess.Board()
+        for move in sequence.split():
+            board.push_uci(move)
+        boards.append(board)
+    per_call = measure(lambda: [index.match_moves(sequence) for sequence in sequences])
+    results = {"openings.match_moves.lookups_per_sec": metric(len(sequences) / per_call, "lookups/s", True)}
+    per_call = measure(lambda: [index.match_position(board) for board in boards])
+    results["openings.match_position.lookups_per_sec"] = metric(len(boards) / per_call, "lookups/s", True)
+    results["openings.index_build_ms"] = metric(build_time * 1000, "ms", False)
+    results["openings.entries"] = metric(len(entries), f"entries ({source})", None)
+    return results
+
+
+def bench_engines(engine_paths, cold_starts=3):
+    """Cold-start latency (process start and UCI handshake) and warm-call latency of each UCI engine."""
+    results = {}
+    for name, path in engine_paths.items():
+        if not os.path.exists(path):
+            print(f"Skipping {name} benchmark: {path} not found", file=sys.stderr)
+            continue
+        timings = []
+        for _ in range(cold_starts):
+            pool = EnginePool(path, size=1)
+            start = time.perf_counter()
+            with pool.engine():
+                timings.append(time.perf_counter() - start)
+            pool.close()
+        results[f"engine.{name}.cold_start_ms"] = metric(min(timings) * 1000, "ms", False)
+
+        pool = EnginePool(path, size=1)
+        try:
+            with pool.engine():
+                pass
+            boards = [chess.Board(fen) for _, fen in corpus()]
+            latencies, nodes, search_time = [], 0, 0.0
+            for board in boards:
+                start = time.perf_counter()
+                with pool.engine() as engine:
+                    info = engine.analyse(board, chess.engine.Limit(depth=BENCH_DEPTH), game=object())
+                latencies.append(time.perf_counter() - start)
+                nodes += info.get("nodes", 0)
+                search_time += info.get("time", 0.0)
+        finally:
+            pool.close()
+        results[f"engine.{name}.warm_call_ms"] = metric(sum(latencies) / len(latencies) * 1000, "ms", False)
+        if search_time:
+            results[f"engine.{name}.nps"] = metric(nodes / search_time, "nodes/s", True)
+    return results
+
+
+def bench_sapientia():
+    """Nodes per second of the in-process Sapientia search at a fixed depth."""
+    nodes, elapsed = 0, 0.0
+    for _, fen in corpus():
+        result = SapientiaEngine(TranspositionTable()).search(chess.Board(fen), depth=SAPIENTIA_BENCH_DEPTH)
+        nodes += result["nodes"]
+        elapsed += result["time"]
+    return {"sapientia.nps": metric(nodes / elapsed, "nodes/s", True)}
+
+
+def bench_store(operations=2000):
+    """Write and read throughput of the SQLite analysis store."""
+    fens = [fen for _, fen in corpus()]
+    with tempfile.TemporaryDirectory() as directory:
+        store = AnalysisStore(os.path.join(directory, "bench.sqlite3"))
+        start = time.perf_counter()
+        for i in range(operations):
+            store.put(fens[i % len(fens)], f"engine{i // len(fens)}", i, "e2e4")
+        put_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(operations):
+            store.get(fens[i % len(fens)], f"engine{i // len(fens)}", 1)
+        get_time = time.perf_counter() - start
+        store.close()
+    return {
+        "store.put_per_sec": metric(operations / put_time, "ops/s", True),
+        "store.get_per_sec": metric(operations / get_time, "ops/s", True),
+    }
+
+
+def bench_end_to_end():
+    """
+    Wall time of the full analysis of a position, timed on END_TO_END_PATH.
+
+    The GUI itself needs IPython widgets, so its `run_analysis` call is reproduced
+    here instead, with a shorter engine time limit.
+    """
+    print(f"end_to_end measures {END_TO_END_PATH}", file=sys.stderr)
+    executor = concurrent.futures.ThreadPoolExecutor()
+    limit = chess.engine.Limit(time=END_TO_END_TIME_LIMIT)
+    cold, warm = [], []
+    try:
+        with local_stand_ins():
+            for _, fen in corpus():
+                board = chess.Board(fen)
+                cache = AnalysisCache()
+                game = object()
+                for timings in (cold, warm):
+                    # The second run of each position is answered from the analysis cache
+                    trace = Trace()
+                    with use_trace(trace):
+                        result = run_analysis(board, limit, executor, deadline=END_TO_END_TIME_LIMIT + 2.5,
+                                              cache=cache, trace=trace, game=game)
+                    timings.append(result["elapsed"])
+    finally:
+        executor.shutdown(wait=False)
+    return {
+        "analysis.end_to_end_ms": metric(sum(cold) / len(cold) * 1000, "ms", False) | {"path": END_TO_END_PATH},
+        "analysis.cached_ms": metric(sum(warm) / len(warm) * 1000, "ms", False) | {"path": END_TO_END_PATH},
+    }
+
+
+# Benchmark groups, run in this order
+BENCHMARKS = {
+    "evaluation": bench_evaluation,
+    "mobility_reference": bench_mobility_reference,
+    "openings": bench_openings,
+    "sapientia": bench_sapientia,
+    "store": bench_store,
+    "engines": lambda: bench_engines({"stockfish": STOCKFISH_PATH, "komodo": KOMODO_PATH}),
+    "end_to_end": bench_end_to_end,
+}
+
+
+def run_benchmarks(groups=None):
+    """Run benchmark groups (all by default) and return the results with the machine description."""
+    metrics = {}
+    for name in groups or BENCHMARKS:
+        print(f"Running {name} benchmarks...", file=sys.stderr)
+        metrics.update(BENCHMARKS[name]())
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "python_chess": chess.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "metrics": metrics,
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, thresholds=None):
+    """
+    Compare results with a baseline.
+
+    Args:
+        results (dict): Output of `run_benchmarks`.
+        baseline (dict): An earlier output of `run_benchmarks`.
+        threshold (float): Relative change in the bad direction that counts as a regression.
+        thresholds (dict): Per-metric thresholds overriding `threshold`.
+
+    Returns:
+        list: (metric, baseline value, new value, relative change, regressed) for every
+        metric present in both, where the change is positive when it is an improvement.
+    """
+    rows = []
+    for name, new in sorted(results["metrics"].items()):
+        old = baseline["metrics"].get(name)
+        if old is None or new["higher_is_better"] is None or not old["value"]:
+            continue
+        change = (new["value"] - old["value"]) / old["value"]
+        if not new["higher_is_better"]:
+            change = -change
+        limit = (thresholds or {}).get(name, threshold)
+        rows.append((name, old["value"], new["value"], change, change < -limit))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Sapientia evaluation, openings, engines and I/O paths.")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--baseline", help="Earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative slowdown that counts as a regression")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Benchmark groups to run")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        # Read first, so the baseline may also be the output file
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    results = run_benchmarks(args.only)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    for name, value in results["metrics"].items():
+        print(f"{name:45} {value['value']:14.1f} {value['unit']}")
+
+    if baseline is not None:
+        regressions = 0
+        print()
+        for name, old, new, change, regressed in compare(results, baseline, args.threshold):
+            regressions += regressed
+            print(f"{name:45} {old:14.1f} -> {new:14.1f} {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+        if regressions:
+            print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
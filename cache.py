@@ -0,0 +1,96 @@
+import sys
+import threading
+from collections import OrderedDict
+import chess.polyglot
+
+# Default memory budget of the analysis cache, in bytes
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+def position_key(board):
+    """
+    Return the transposition-aware key of a position.
+
+    The Zobrist hash covers pieces, side to move, castling rights and en passant,
+    but not the halfmove or fullmove counters, so transpositions share a key.
+    """
+    return chess.polyglot.zobrist_hash(board)
+
+
+def estimate_size(value):
+    """Roughly estimate the memory used by a cached value, in bytes."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class AnalysisCache:
+    """
+    Bounded LRU cache of analysis results, stored separately for each source.
+
+    Entries are keyed by (position hash, source, params), where `params` holds
+    whatever else the result depends on (e.g. the engine depth). A cached GM
+    lookup is therefore reused even when the engine depth changes.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, board, source, params=()):
+        """Return the cached result for a source, or None on a miss."""
+        key = (position_key(board), source, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, board, source, value, params=()):
+        """Store a source's result, evicting least recently used entries to stay within budget."""
+        key = (position_key(board), source, params)
+        size = estimate_size(key) + estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current size of the cache."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,102 +1,229 @@
+import os
+import threading
+import chess
+import chess.syzygy
 import requests
+from tracing import span
+
+# URL of the Lichess Syzygy tablebase API
+TABLEBASE_URL = "http://tablebase.lichess.ovh/standard"
+
+# Syzygy tablebases only cover positions with up to 7 pieces (kings included)
+MAX_TABLEBASE_PIECES = 7
+
+# Seconds to wait for the tablebase API before giving up
+REQUEST_TIMEOUT = 5
+
+# Directories with local Syzygy WDL/DTZ files, separated by os.pathsep (e.g. "/data/syzygy")
+SYZYGY_PATH = os.environ.get("SYZYGY_PATH", "")
+
+# One keep-alive session shared by all tablebase requests
+session = requests.Session()
+
+# Tablebase categories for the WDL values returned by chess.syzygy
+WDL_CATEGORIES = {2: "win", 1: "cursed-win", 0: "draw", -1: "blessed-loss", -2: "loss"}
+
+
+def count_pieces(fen: str) -> int:
+    """Count the pieces (kings included) in the board part of a FEN string."""
+    return sum(char.isalpha() for char in fen.split()[0])
+
+
+class LocalSyzygyBackend:
+    """
+    Probe local Syzygy files through python-chess.
+
+    The tablebase is opened on the first probe; python-chess then opens and
+    memory-maps each table file lazily, the first time a position needs it.
+    """
+
+    def __init__(self, directories):
+        self.directories = [directory for directory in directories if directory]
+        self._tablebase = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        with self._lock:
+            if self._tablebase is None:
+                tablebase = chess.syzygy.Tablebase()
+                for directory in self.directories:
+                    tablebase.add_directory(directory)
+                self._tablebase = tablebase
+            return self._tablebase
+
+    def probe(self, fen):
+        """Return the tablebase result for a position, or None if the local tables cannot answer."""
+        tablebase = self._open()
+        board = chess.Board(fen)
+        try:
+            wdl = tablebase.probe_wdl(board)
+            dtz = tablebase.probe_dtz(board)
+            moves = []
+            for move in board.legal_moves:
+                zeroing = board.is_zeroing(move)
+                board.push(move)
+                # Child values are from the opponent's point of view
+                moves.append((-tablebase.probe_wdl(board), zeroing, -tablebase.probe_dtz(board), move))
+                board.pop()
+        except KeyError:
+            # MissingTableError, or a position python-chess does not probe (e.g. with castling rights)
+            return None
+
+        def rank(entry):
+            child_wdl, zeroing, child_dtz, _ = entry
+            if child_wdl > 0:
+                # Winning: prefer zeroing moves, then the fastest conversion
+                return (-child_wdl, not zeroing, abs(child_dtz))
+            # Drawing or losing: hold out as long as possible
+            return (-child_wdl, False, -abs(child_dtz))
+
+        data = {
+            "category": WDL_CATEGORIES[wdl],
+            "dtz": dtz,
+            "moves": [{"uci": entry[3].uci()} for entry in sorted(moves, key=rank)],
+        }
+        return parse_tablebase_response(fen, data, source="local")
+
+    def close(self):
+        with self._lock:
+            if self._tablebase is not None:
+                self._tablebase.close()
+                self._tablebase = None
+
+
+class HttpTablebaseBackend:
+    """Probe the Lichess Syzygy tablebase API over the shared HTTP session."""
+
+    def __init__(self, url=TABLEBASE_URL, timeout=REQUEST_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def probe(self, fen):
+        """Return the tablebase result for a position, or a dict with "Error" if the request failed."""
+        try:
+            # Replace spaces with underscores in the FEN string for API compatibility
+            response = session.get(self.url, params={"fen": fen.replace(" ", "_")}, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return {"FEN": fen, "Error": f"Request failed: {e}"}
+        return parse_tablebase_response(fen, data, source="http")
+
+
+def set_syzygy_path(path):
+    """
+    Use local Syzygy files from `path` (os.pathsep-separated directories), with the HTTP API as fallback.
+
+    Pass an empty path to go back to the HTTP API only.
+    """
+    global tablebase_backends
+    for backend in tablebase_backends:
+        if isinstance(backend, LocalSyzygyBackend):
+            backend.close()
+    backends = [HttpTablebaseBackend()]
+    if path:
+        backends.insert(0, LocalSyzygyBackend(path.split(os.pathsep)))
+    tablebase_backends = backends
+
+
+# Backends tried in order by probe_endgame; the first one that can answer wins
+tablebase_backends = []
+set_syzygy_path(SYZYGY_PATH)
+
+
+def probe_endgame(fen: str) -> dict:
+    """
+    Probe the Syzygy tablebase once for WDL, DTZ and the ranked moves of a position.
+
+    Local tables are used when configured (see `set_syzygy_path`), with the
+    Lichess API as fallback. Positions with more than MAX_TABLEBASE_PIECES
+    pieces are not probed at all.
+
+    Args:
+        fen (str): The FEN string representing the current board state.
+
+    Returns:
+        dict: "FEN", "WDL", "DTZ", "WDL_numeric", "DTZ_numeric", "category", "moves"
+        (UCI moves, best first), "best_move" (UCI or None) and "source" ("local" or
+        "http"); or "FEN" and "Error" if the position is not available.
+    """
+    if count_pieces(fen) > MAX_TABLEBASE_PIECES:
+        return {"FEN": fen, "Error": "Too many pieces for the tablebase."}
+
+    with span("tablebase.probe") as span_args:
+        result = None
+        for backend in tablebase_backends:
+            result = backend.probe(fen)
+            if result is not None and "Error" not in result:
+                span_args["source"] = result["source"]
+                return result
+        span_args["outcome"] = "unavailable"
+        return result
+
+
+def parse_tablebase_response(fen: str, data: dict, source: str = "http") -> dict:
+    """Turn a tablebase API response into the result dict of `probe_endgame`."""
+    # Check if the 'category' field exists in the response
+    if "category" not in data:
+        return {"FEN": fen, "Error": "Position not available in tablebase."}
+
+    wdl = data["category"]
+    dtz = data["dtz"]
+
+    # Extract which player's turn it is from the FEN (the second part of the FEN string)
+    turn = fen.split()[1]  # "w" or "b"
+
+    # Map WDL to the output text (Win/Draw/Loss) based on whose turn it is
+    if wdl == "win":
+        result = "Win for White" if turn == 'w' else "Win for Black"
+    elif wdl == "loss":
+        result = "Loss for White" if turn == 'w' else "Loss for Black"
+    elif wdl == "draw":
+        result = "Draw"
+    else:
+        result = "Unknown result"
+
+    # Ranked moves, best first; UCI moves must be 4 or 5 characters long
+    moves = [move["uci"] for move in data.get("moves", []) if len(move.get("uci", "")) in [4, 5]]
+    best_move = moves[0] if moves and wdl not in ['null', 'unknown'] else None
+
+    return {
+        "FEN": fen,
+        "WDL": result,
+        "DTZ": dtz,
+        "WDL_numeric": 1 if wdl == "win" else -1 if wdl == "loss" else 0,
+        "DTZ_numeric": dtz,
+        "category": wdl,
+        "moves": moves,
+        "best_move": best_move,
+        "source": source,
+    }
+
 
 # Function to fetch WDL and DTZ from Lichess Syzygy tablebase
 def fetch_endgame_tablebase_data(fen: str):
     """
     Fetch WDL (Win/Draw/Loss) and DTZ (Distance to Zero) for a given FEN
-    from the Lichess Syzygy tablebase API, replacing spaces with underscores.
+    from the Lichess Syzygy tablebase API.
     """
-    # Save original FEN for local processing
-    original_fen = fen
-    
-    # Replace spaces with underscores in the FEN string for API compatibility
-    fen = fen.replace(" ", "_")
-    
-    # Construct the URL for the Lichess Syzygy API request
-    url = f"http://tablebase.lichess.ovh/standard?fen={fen}"
-    
-    try:
-        # Make a GET request to the Lichess API
-        response = requests.get(url)
-        data = response.json()
-        
-        # Check if the 'category' field exists in the response
-        if "category" in data:
-            wdl = data["category"]
-            dtz = data["dtz"]
-
-            # Extract which player's turn it is from the original FEN (the second part of the FEN string)
-            turn = original_fen.split()[1]  # "w" or "b"
-
-            # Map WDL to the output text (Win/Draw/Loss) based on whose turn it is
-            if wdl == "win":
-                result = "Win for White" if turn == 'w' else "Win for Black"
-            elif wdl == "loss":
-                result = "Loss for White" if turn == 'w' else "Loss for Black"
-            elif wdl == "draw":
-                result = "Draw"
-            else:
-                result = "Unknown result"
-
-            # Return the result as a dictionary
-            return {
-                "FEN": original_fen,
-                "WDL": result,
-                "DTZ": dtz,
-                "WDL_numeric": 1 if wdl == "win" else -1 if wdl == "loss" else 0,
-                "DTZ_numeric": dtz
-            }
-        else:
-            return {"FEN": original_fen, "Error": "Position not available in tablebase."}
-    except requests.exceptions.RequestException as e:
-        return {"FEN": original_fen, "Error": f"Request failed: {e}"}
+    probe = probe_endgame(fen)
+    if "Error" in probe:
+        return probe
+    return {key: probe[key] for key in ("FEN", "WDL", "DTZ", "WDL_numeric", "DTZ_numeric")}
+
 
 def best_endgame_move(fen: str, turn: str) -> str:
     """
     Fetch the best move from the Lichess Syzygy tablebase API for a given position (FEN) and turn.
-    
+
     Args:
         fen (str): The FEN string representing the current board state.
         turn (str): The color of the player to move. Should be 'white' or 'black'.
-    
+
     Returns:
         str: The best move in UCI notation or None if no valid move found or category is 'null' or 'unknown'.
     """
-    # Replace spaces with underscores in the FEN string for API compatibility
-    fen = fen.replace(" ", "_")
-    
-    # Construct the URL for the Lichess Syzygy API request
-    url = f"http://tablebase.lichess.ovh/standard?fen={fen}"
-    
-    try:
-        # Make a GET request to the Lichess API
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an error for bad status codes
-        
-        # Parse the response JSON
-        data = response.json()
-
-        # Check if 'category' exists and is neither 'null' nor 'unknown'
-        category = data.get('category')
-        if category not in ['null', 'unknown']:
-            # Check if the 'moves' key exists and the list is not empty
-            if 'moves' in data and len(data['moves']) > 0:
-                # Extract the first UCI move
-                first_move_uci = data['moves'][0]['uci']
-
-                # Validate the UCI move string (length check for UCI moves)
-                if len(first_move_uci) in [4, 5]:  # UCI move must be 4 or 5 characters long
-                    return first_move_uci
-                else:
-                    return None
-            else:
-                # If no valid moves were found, return None
-                return None
-        else:
-            # If 'category' is 'null' or 'unknown', return None
-            return None
-    
-    except requests.exceptions.RequestException as e:
-        # Handle any errors that occur during the request (e.g., network issues)
-        print(f"Error: {e}")
-        return None
\ No newline at end of file
+    probe = probe_endgame(fen)
+    if probe.get("Error", "").startswith("Request failed"):
+        print(f"Error: {probe['Error']}")
+    return probe.get("best_move")
@@ -1,35 +1,336 @@
+import atexit
 import chess
 import os
+import queue
+import threading
+from contextlib import closing, contextmanager
 from chess.engine import SimpleEngine
+from store import get_analysis_store
+from tracing import span
 
-def fetch_stockfish_data(fen, depth=3, stockfish_path="/usr/games/stockfish"):
+# Default number of warm processes kept per engine binary
+DEFAULT_POOL_SIZE = 2
+
+# Seconds to wait for an engine to answer "isready" during a health check
+HEALTH_CHECK_TIMEOUT = 2.0
+
+
+class EnginePool:
+    """
+    A pool of long-lived UCI engine processes for a single engine binary.
+
+    Engines are started lazily (up to `size` processes), handed out with
+    `checkout()` and returned with `checkin()`. Every checkout runs a health
+    check, and engines that crashed or stopped answering are restarted.
+    """
+
+    def __init__(self, engine_path, size=DEFAULT_POOL_SIZE):
+        self.engine_path = engine_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._started = 0
+        self._closed = False
+
+    def _spawn(self):
+        """Start a new engine process and complete the UCI handshake."""
+        # Ensure the engine has execute permissions
+        os.chmod(self.engine_path, 0o755)
+        with span("engine.start", engine=os.path.basename(self.engine_path)):
+            return SimpleEngine.popen_uci(self.engine_path)
+
+    def _is_healthy(self, engine):
+        """Return True if the engine process is alive and answers "isready"."""
+        previous_timeout = engine.timeout
+        try:
+            engine.timeout = HEALTH_CHECK_TIMEOUT
+            engine.ping()
+            return True
+        except Exception:
+            return False
+        finally:
+            engine.timeout = previous_timeout
+
+    def _discard(self, engine):
+        """Shut down an engine and free its slot in the pool."""
+        try:
+            engine.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._started -= 1
+
+    def checkout(self, timeout=None):
+        """
+        Take a warm engine out of the pool.
+
+        Args:
+            timeout (float): Seconds to wait for a free engine when all of them are busy.
+
+        Returns:
+            SimpleEngine: A healthy engine, which must be returned with `checkin()`.
+        """
+        if self._closed:
+            raise RuntimeError(f"Engine pool for {self.engine_path} is shut down")
+
+        while True:
+            try:
+                engine = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_spawn = self._started < self.size
+                    if can_spawn:
+                        self._started += 1
+                if can_spawn:
+                    try:
+                        return self._spawn()
+                    except Exception:
+                        with self._lock:
+                            self._started -= 1
+                        raise
+                try:
+                    engine = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No idle engine for {self.engine_path} after {timeout}s")
+
+            if self._is_healthy(engine):
+                return engine
+            # Restart crashed engines transparently
+            self._discard(engine)
+
+    def checkin(self, engine, discard=False):
+        """Return an engine to the pool, or shut it down if it is broken or the pool is closed."""
+        if discard or self._closed:
+            self._discard(engine)
+        else:
+            self._idle.put(engine)
+
+    @contextmanager
+    def engine(self, timeout=None):
+        """Context manager around `checkout()`/`checkin()`; engines that fail are discarded."""
+        with span("engine.checkout", engine=os.path.basename(self.engine_path)):
+            engine = self.checkout(timeout=timeout)
+        try:
+            yield engine
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, TimeoutError):
+            self.checkin(engine, discard=True)
+            raise
+        except BaseException:
+            self.checkin(engine)
+            raise
+        else:
+            self.checkin(engine)
+
+    def close(self):
+        """Quit all idle engines. Engines still checked out are closed on checkin."""
+        self._closed = True
+        while True:
+            try:
+                engine = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                engine.quit()
+            except Exception:
+                engine.close()
+            with self._lock:
+                self._started -= 1
+
+
+# Engine pools shared by the whole process, keyed by engine path
+_engine_pools = {}
+_engine_pools_lock = threading.Lock()
+
+
+def get_engine_pool(engine_path, size=DEFAULT_POOL_SIZE):
+    """Return the shared pool for an engine binary, creating it on first use and growing it to `size`."""
+    with _engine_pools_lock:
+        pool = _engine_pools.get(engine_path)
+        if pool is None or pool._closed:
+            pool = EnginePool(engine_path, size=size)
+            _engine_pools[engine_path] = pool
+        elif size > pool.size:
+            with pool._lock:
+                pool.size = size
+        return pool
+
+
+def shutdown_engine_pools():
+    """Quit every pooled engine process. Registered to run at interpreter exit."""
+    with _engine_pools_lock:
+        pools = list(_engine_pools.values())
+        _engine_pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+# python-chess runs each engine on a non-daemon thread, so the pools must be shut
+# down before the interpreter joins those threads (plain atexit would run too late)
+if hasattr(threading, "_register_atexit"):
+    threading._register_atexit(shutdown_engine_pools)
+else:
+    atexit.register(shutdown_engine_pools)
+
+
+# Default locations of the engine binaries
+STOCKFISH_PATH = "/usr/games/stockfish"
+KOMODO_PATH = "/content/komodo3sse42"
+
+# Default number of principal variations reported by streaming analysis
+DEFAULT_MULTIPV = 3
+
+# Centipawn value reported for a mate score
+MATE_SCORE = 100000
+
+
+def fetch_engine_data(fen, engine_path, depth=None, time_limit=None, game=None, store=None):
+    """
+    Search a FEN position with a pooled engine under a depth and/or time limit.
+
+    With `time_limit`, the engine returns its best move so far when the deadline
+    hits, and the result reports the depth it reached. Results are looked up in
+    and saved to the on-disk analysis store (the default store if `store` is None,
+    no store if it is False), keyed by engine binary name and depth.
+
+    Args:
+        fen (str): The position in FEN notation.
+        engine_path (str): Path of the UCI engine binary.
+        depth (int): Maximum search depth.
+        time_limit (float): Seconds the engine may search.
+        game (object): Game key; a change makes python-chess send "ucinewgame" first.
+        store (store.AnalysisStore): Analysis store to use, or False for none.
+
+    Returns:
+        dict: "move" (UCI), "depth" reached, "time" spent in seconds and "stored"
+        (True if the result came from the analysis store).
+    """
+    if store is None:
+        store = get_analysis_store()
+    engine_name = os.path.basename(engine_path)
+    # Only a depth-limited search knows in advance which stored depth is good enough
+    if store and depth is not None and time_limit is None:
+        stored = store.get(fen, engine_name, depth)
+        if stored is not None:
+            return {"move": stored["move"], "depth": stored["depth"], "time": 0.0, "stored": True}
+
+    board = chess.Board(fen)
+    with get_engine_pool(engine_path).engine() as engine:
+        result = engine.play(board, chess.engine.Limit(depth=depth, time=time_limit), game=game,
+                             info=chess.engine.INFO_BASIC)
+    move = result.move.uci()
+    reached_depth = result.info.get("depth", depth)
+    if store and reached_depth:
+        store.put(fen, engine_name, reached_depth, move)
+    return {"move": move, "depth": reached_depth, "time": result.info.get("time"), "stored": False}
+
+
+def fetch_stockfish_data(fen, depth=3, stockfish_path=STOCKFISH_PATH, game=None, store=None, time_limit=None):
     """
     Fetch the best move for a given FEN position using the Stockfish engine.
     """
     try:
-        # Ensure the Stockfish engine has execute permissions
-        os.chmod(stockfish_path, 0o755)
-
-        board = chess.Board(fen)
-        with SimpleEngine.popen_uci(stockfish_path) as engine:
-            result = engine.play(board, chess.engine.Limit(depth=depth))
-            return result.move.uci()
+        return fetch_engine_data(fen, stockfish_path, depth=depth, time_limit=time_limit, game=game, store=store)["move"]
     except Exception as e:
         print(f"Error while fetching best move from Stockfish: {e}")
         return None
 
-def fetch_komodo_data(fen, depth=3, komodo_path="/content/komodo3sse42"):
+
+def fetch_komodo_data(fen, depth=3, komodo_path=KOMODO_PATH, game=None, store=None, time_limit=None):
     """
     Fetch the best move for a given FEN position using the Komodo engine.
     """
     try:
-        # Ensure that the Komodo engine has execute permissions
-        os.chmod(komodo_path, 0o755)
-
-        board = chess.Board(fen)
-        with SimpleEngine.popen_uci(komodo_path) as engine:
-            result = engine.play(board, chess.engine.Limit(depth=depth))
-            return result.move.uci()
+        return fetch_engine_data(fen, komodo_path, depth=depth, time_limit=time_limit, game=game, store=store)["move"]
     except Exception as e:
         print(f"Error while fetching best move from Komodo: {e}")
         return None
+
+
+def format_analysis_line(info):
+    """Turn a python-chess analysis info dict into a plain dict with the score from the side to move's view."""
+    score = info["score"].relative
+    pv = [move.uci() for move in info.get("pv", [])]
+    return {
+        "multipv": info.get("multipv", 1),
+        "move": pv[0] if pv else None,
+        "pv": pv,
+        "depth": info.get("depth"),
+        "score": score.score(mate_score=MATE_SCORE),
+        "mate": score.mate(),
+        "nodes": info.get("nodes"),
+        "nps": info.get("nps"),
+    }
+
+
+def stream_engine_analysis(fen, engine_path, multipv=DEFAULT_MULTIPV, depth=None, time_limit=None, game=None,
+                           checkout_timeout=None):
+    """
+    Stream MultiPV analysis of a FEN position from a pooled engine.
+
+    Yields the current lines (best first, see `format_analysis_line`) every time
+    the engine reports progress, so callers can show results as they deepen.
+    The analysis stops at the depth or time limit, or when the caller stops
+    iterating; the engine then goes back to the pool. If no pooled engine is free
+    within `checkout_timeout` seconds, TimeoutError is raised.
+    """
+    board = chess.Board(fen)
+    with get_engine_pool(engine_path).engine(timeout=checkout_timeout) as engine, \
+            span("engine.search", engine=os.path.basename(engine_path)):
+        analysis = engine.analysis(board, chess.engine.Limit(depth=depth, time=time_limit), multipv=multipv, game=game)
+        try:
+            for info in analysis:
+                if "pv" not in info or "score" not in info:
+                    continue
+                lines = []
+                for line in analysis.multipv:
+                    # Mid-iteration, a stale lower line may repeat the new best move
+                    if "pv" in line and "score" in line and all(line["pv"][0] != seen["pv"][0] for seen in lines):
+                        lines.append(line)
+                yield [format_analysis_line(line) for line in lines]
+        finally:
+            # Make sure the engine is idle before it goes back to the pool
+            analysis.stop()
+            analysis.wait()
+
+
+def analyse_engine_lines(fen, engine_path, multipv=DEFAULT_MULTIPV, depth=None, time_limit=None,
+                         game=None, store=None, on_update=None, stop_event=None, checkout_timeout=None):
+    """
+    Run a MultiPV analysis to its limit and return the final lines.
+
+    Args:
+        on_update (callable): Called with the current lines whenever the best line reaches a new depth.
+        stop_event (threading.Event): When set, the analysis stops early with the lines found so far.
+        checkout_timeout (float): Seconds to wait for a free pooled engine (None waits as long as it takes).
+        store (store.AnalysisStore): Analysis store the best move is saved to (None for the default, False for none).
+
+    Returns:
+        list: The lines of the deepest iteration, best first. A depth-limited request
+        answered from the analysis store has a single line without score.
+    """
+    if store is None:
+        store = get_analysis_store()
+    if store and depth is not None and time_limit is None:
+        with span("engine.store", engine=os.path.basename(engine_path)) as span_args:
+            stored = store.get(fen, os.path.basename(engine_path), depth)
+            span_args["cache"] = "miss" if stored is None else "hit"
+        if stored is not None:
+            return [{"multipv": 1, "move": stored["move"], "pv": [stored["move"]], "depth": stored["depth"],
+                     "score": None, "mate": None, "nodes": None, "nps": None}]
+
+    lines = []
+    reported_depth = None
+    stream = stream_engine_analysis(fen, engine_path, multipv=multipv, depth=depth, time_limit=time_limit, game=game,
+                                    checkout_timeout=checkout_timeout)
+    with closing(stream):
+        for lines in stream:
+            if on_update is not None and lines[0]["depth"] != reported_depth:
+                reported_depth = lines[0]["depth"]
+                on_update(lines)
+            if stop_event is not None and stop_event.is_set():
+                # Closing the stream stops the search and frees the engine right away
+                return lines
+
+    if store and lines and lines[0]["move"] and lines[0]["depth"]:
+        store.put(fen, os.path.basename(engine_path), lines[0]["depth"], lines[0]["move"])
+    return lines
@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import concurrent.futures
+import chess
+import chess.engine
+from engines import get_engine_pool, STOCKFISH_PATH, KOMODO_PATH
+from sapientia_engine import SapientiaEngine, TranspositionTable
+
+# Parallel searches per engine (UCI engines get a pool of this many processes)
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Seconds per position when neither a time nor a node budget is given
+DEFAULT_TIME_LIMIT = 1.0
+
+# UCI engines the runner knows; "sapientia" runs in-process
+UCI_ENGINES = {"stockfish": STOCKFISH_PATH, "komodo": KOMODO_PATH}
+
+
+def read_epd_suite(path):
+    """
+    Read an EPD test suite.
+
+    Returns:
+        list: One dict per position with "id", "fen", "bm" and "am" (lists of UCI moves).
+        Positions without a "bm" or "am" opcode are skipped.
+    """
+    positions = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                board, ops = chess.Board.from_epd(line)
+            except ValueError as e:
+                print(f"Skipping line {number} of {path}: {e}", file=sys.stderr)
+                continue
+            best = [move.uci() for move in ops.get("bm", [])]
+            avoid = [move.uci() for move in ops.get("am", [])]
+            if not best and not avoid:
+                continue
+            positions.append({"id": ops.get("id", f"{os.path.basename(path)}:{number}"),
+                              "fen": board.fen(), "bm": best, "am": avoid})
+    return positions
+
+
+def is_solution(move, position):
+    """Return True if a UCI move is one of the best moves (if any) and none of the moves to avoid."""
+    if move is None:
+        return False
+    if position["bm"] and move not in position["bm"]:
+        return False
+    return move not in position["am"]
+
+
+def time_to_solution(iterations, position):
+    """
+    Return the time of the first iteration from which the engine kept a solution move, or None.
+
+    Args:
+        iterations (list): (move, seconds, depth) of each reported iteration, in order.
+    """
+    found = None
+    for move, seconds, _ in iterations:
+        if is_solution(move, position):
+            if found is None:
+                found = seconds
+        else:
+            found = None
+    return found
+
+
+def solve_with_uci(position, engine_path, limit):
+    """Search a suite position with a pooled UCI engine and return its result (see `result_entry`)."""
+    board = chess.Board(position["fen"])
+    iterations = []
+    info = {}
+    with get_engine_pool(engine_path).engine() as engine:
+        # A new game per position, so the hash of earlier positions does not help
+        with engine.analysis(board, limit, game=object()) as analysis:
+            for info in analysis:
+                if "pv" in info and info["pv"]:
+                    iterations.append((info["pv"][0].uci(), info.get("time", 0.0), info.get("depth")))
+            info = analysis.info
+    move = info["pv"][0].uci() if info.get("pv") else (iterations[-1][0] if iterations else None)
+    return result_entry(position, move, iterations, info.get("depth"), info.get("nodes", 0), info.get("time", 0.0))
+
+
+def solve_with_sapientia(position, limit):
+    """Search a suite position with the in-process Sapientia engine (run in a worker process)."""
+    iterations = []
+    result = SapientiaEngine(TranspositionTable()).search(
+        chess.Board(position["fen"]), time_limit=limit.time, node_limit=limit.nodes,
+        info_callback=lambda info: iterations.append((info["move"], info["time"], info["depth"])))
+    return result_entry(position, result["move"], iterations, result["depth"], result["nodes"], result["time"])
+
+
+def result_entry(position, move, iterations, depth, nodes, seconds):
+    """Return the per-position result: the move played, whether it solves the position, and search stats."""
+    solved = is_solution(move, position)
+    return {
+        "id": position["id"],
+        "fen": position["fen"],
+        "bm": position["bm"],
+        "am": position["am"],
+        "move": move,
+        "solved": solved,
+        "time_to_solution": time_to_solution(iterations, position) if solved else None,
+        "depth": depth,
+        "nodes": nodes,
+        "time": seconds,
+        "nps": int(nodes / seconds) if seconds else 0,
+    }
+
+
+def summarize(results):
+    """Return the solve rate, mean time-to-solution, mean depth and overall nps of an engine's results."""
+    solved = [result for result in results if result["solved"]]
+    depths = [result["depth"] for result in results if result["depth"] is not None]
+    total_time = sum(result["time"] for result in results)
+    return {
+        "positions": len(results),
+        "solved": len(solved),
+        "solve_rate": len(solved) / len(results) if results else 0.0,
+        "mean_time_to_solution": (sum(result["time_to_solution"] for result in solved) / len(solved)
+                                  if solved else None),
+        "mean_depth": sum(depths) / len(depths) if depths else None,
+        "nps": int(sum(result["nodes"] for result in results) / total_time) if total_time else 0,
+    }
+
+
+def run_suite(positions, engines, limit, workers=DEFAULT_WORKERS):
+    """
+    Solve every suite position with every engine, `workers` positions at a time per engine.
+
+    Args:
+        positions (list): Output of `read_epd_suite`.
+        engines (dict): Engine name -> UCI binary path, or None for the in-process Sapientia engine.
+        limit (chess.engine.Limit): Time or node budget per position.
+        workers (int): Parallel searches per engine.
+
+    Returns:
+        dict: {engine: {"summary": `summarize` output, "positions": per-position results in suite order}}.
+    """
+    report = {}
+    for name, path in engines.items():
+        start = time.monotonic()
+        if path is None:
+            # The in-process search is pure Python, so it needs processes to use several cores;
+            # they are spawned rather than forked because the engine pools run threads
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results = list(executor.map(solve_with_sapientia, positions, [limit] * len(positions)))
+        else:
+            get_engine_pool(path, size=workers)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lambda position: solve_with_uci(position, path, limit), positions))
+        summary = summarize(results)
+        summary["wall_time"] = time.monotonic() - start
+        report[name] = {"summary": summary, "positions": results}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an EPD test suite (bm/am opcodes) against the engines.")
+    parser.add_argument("suite", help="EPD file")
+    parser.add_argument("--engines", nargs="+", choices=sorted(UCI_ENGINES) + ["sapientia"],
+                        default=sorted(UCI_ENGINES) + ["sapientia"], help="Engines to test")
+    parser.add_argument("--stockfish-path", default=STOCKFISH_PATH, help="Path of the Stockfish binary")
+    parser.add_argument("--komodo-path", default=KOMODO_PATH, help="Path of the Komodo binary")
+    budget = parser.add_mutually_exclusive_group()
+    budget.add_argument("--time", type=float, help=f"Seconds per position (default {DEFAULT_TIME_LIMIT})")
+    budget.add_argument("--nodes", type=int, help="Nodes per position")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Parallel searches per engine")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    if args.nodes is not None:
+        limit = chess.engine.Limit(nodes=args.nodes)
+    else:
+        limit = chess.engine.Limit(time=args.time or DEFAULT_TIME_LIMIT)
+    paths = {"stockfish": args.stockfish_path, "komodo": args.komodo_path, "sapientia": None}
+    engines = {}
+    for name in args.engines:
+        if paths[name] is not None and not os.path.exists(paths[name]):
+            print(f"Skipping {name}: {paths[name]} not found", file=sys.stderr)
+            continue
+        engines[name] = paths[name]
+
+    positions = read_epd_suite(args.suite)
+    report = run_suite(positions, engines, limit, workers=args.workers)
+    for name, results in report.items():
+        summary = results["summary"]
+        ttm = summary["mean_time_to_solution"]
+        print(f"{name:10} solved {summary['solved']}/{summary['positions']} ({summary['solve_rate']:.1%}), "
+              f"time to solution {f'{ttm:.2f}s' if ttm is not None else 'n/a'}, "
+              f"depth {summary['mean_depth'] or 0:.1f}, {summary['nps']} nps")
+
+    if args.output:
+        output = {
+            "meta": {
+                "suite": args.suite,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "limit": {"time": limit.time, "nodes": limit.nodes},
+                "workers": args.workers,
+                "engines": {name: path or "in-process" for name, path in engines.items()},
+            },
+            "engines": report,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -86,57 +86,120 @@ def get_piece_square_table(piece_type, is_white):
         # Flip for Black pieces by reversing the rows and columns
         return [row[::-1] for row in PIECE_SQUARE_TABLES[piece_type]][::-1]
 
-def evaluate_material(board):
-    """Evaluate the material balance of the board."""
-    white_material = sum(len(board.pieces(pt, chess.WHITE)) * PIECE_VALUES[pt] for pt in PIECE_VALUES)
-    black_material = sum(len(board.pieces(pt, chess.BLACK)) * PIECE_VALUES[pt] for pt in PIECE_VALUES)
-    material_diff = white_material - black_material
-    
-    if material_diff > 0:
-        return "Material: Adv for White"
-    elif material_diff < 0:
-        return "Material: Adv for Black"
-    else:
-        return "Material: Even"
+# Flat 64-entry piece-square tables indexed by square, precomputed per color:
+# PIECE_SQUARE_VALUES[color][piece_type][square]
+PIECE_SQUARE_VALUES = {
+    color: {
+        piece_type: [value for row in get_piece_square_table(piece_type, color == chess.WHITE) for value in row]
+        for piece_type in PIECE_SQUARE_TABLES
+    }
+    for color in chess.COLORS
+}
 
-def evaluate_position(board):
-    """Evaluate the positional difference between white and black."""
-    white_position = 0
-    black_position = 0
-
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
-        if piece is None:
-            continue
-
-        is_white = piece.color == chess.WHITE
-        piece_value = PIECE_VALUES[piece.piece_type]
-        
-        # Positional evaluation (using flipped table for black)
-        piece_square_table = get_piece_square_table(piece.piece_type, is_white)
-        square_index = chess.SQUARES.index(square)
-        
-        # Get the positional value based on the piece's position
-        piece_position_value = piece_square_table[square_index // 8][square_index % 8]
-
-        # Accumulate the positional values for white and black
-        if is_white:
-            white_position += piece_position_value
+# Centipawns per extra legal move and per extra controlled square (central squares count twice)
+MOBILITY_WEIGHT = 10
+SPACE_CONTROL_WEIGHT = 5
+
+# Game phase weight of each piece type; PHASE_MAX in the opening, 0 with only kings and pawns
+PHASE_WEIGHTS = {
+    chess.PAWN: 0,
+    chess.KNIGHT: 1,
+    chess.BISHOP: 1,
+    chess.ROOK: 2,
+    chess.QUEEN: 4,
+    chess.KING: 0,
+}
+PHASE_MAX = 24
+
+def game_phase(board):
+    """Return the game phase from the non-pawn material left on the board (PHASE_MAX = opening)."""
+    return sum(weight * chess.popcount(board.pieces_mask(piece_type, chess.WHITE) | board.pieces_mask(piece_type, chess.BLACK))
+               for piece_type, weight in PHASE_WEIGHTS.items())
+
+def evaluate_material_score(board):
+    """Return the material balance in centipawns (positive favours White)."""
+    score = 0
+    for piece_type, value in PIECE_VALUES.items():
+        score += value * (chess.popcount(board.pieces_mask(piece_type, chess.WHITE))
+                          - chess.popcount(board.pieces_mask(piece_type, chess.BLACK)))
+    return score
+
+def evaluate_position_score(board):
+    """Return the piece-square table balance in centipawns (positive favours White)."""
+    score = 0
+    for color, sign in ((chess.WHITE, 1), (chess.BLACK, -1)):
+        tables = PIECE_SQUARE_VALUES[color]
+        for piece_type, table in tables.items():
+            for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+                score += sign * table[square]
+    return score
+
+# Central squares count twice for square control
+CENTRAL_SQUARES = chess.BB_D4 | chess.BB_E4 | chess.BB_D5 | chess.BB_E5
+
+def attack_summary(board):
+    """
+    Compute pseudo-legal mobility and square control for both sides in one pass over the pieces.
+
+    Mobility counts the moves of each piece from its attack bitboard (pawn pushes,
+    captures and promotions included); kings may not step onto squares the
+    opponent controls. Control is the union of all squares a side attacks.
+
+    Returns:
+        dict: {color: (mobility, control_mask)} for chess.WHITE and chess.BLACK.
+    """
+    empty = ~board.occupied & chess.BB_ALL
+    control = {}
+    mobility = {}
+    king_targets = {}
+    for color in chess.COLORS:
+        own = board.occupied_co[color]
+        enemy = board.occupied_co[not color]
+        pawns = board.pawns & own
+        attacked = 0
+        moves = 0
+
+        for square in chess.scan_forward(own & ~pawns & ~board.kings):
+            attacks = board.attacks_mask(square)
+            attacked |= attacks
+            moves += chess.popcount(attacks & ~own)
+
+        # Pawn captures, with en passant for the side to move
+        capture_targets = enemy
+        if board.ep_square is not None and color == board.turn:
+            capture_targets |= chess.BB_SQUARES[board.ep_square]
+        for square in chess.scan_forward(pawns):
+            attacks = chess.BB_PAWN_ATTACKS[color][square]
+            attacked |= attacks
+            captures = attacks & capture_targets
+            moves += chess.popcount(captures) * (4 if captures & chess.BB_BACKRANKS else 1)
+
+        # Pawn pushes; each promotion counts as four moves like in the legal move list
+        if color == chess.WHITE:
+            single = (pawns << 8) & empty
+            double = ((single & chess.BB_RANK_3) << 8) & empty
         else:
-            black_position += piece_position_value
-
-    position_diff = white_position - black_position
-    
-    if position_diff > 0:
-        return "Position: Adv for White"
-    elif position_diff < 0:
-        return "Position: Adv for Black"
-    else:
-        return "Position: Even"
+            single = (pawns >> 8) & empty
+            double = ((single & chess.BB_RANK_6) >> 8) & empty
+        moves += chess.popcount(single & ~chess.BB_BACKRANKS) + 4 * chess.popcount(single & chess.BB_BACKRANKS)
+        moves += chess.popcount(double)
 
-def evaluate_mobility(board) -> str:
-    """Evaluate the mobility of both players."""
-    
+        king_targets[color] = 0
+        for square in chess.scan_forward(board.kings & own):
+            attacks = chess.BB_KING_ATTACKS[square]
+            attacked |= attacks
+            king_targets[color] |= attacks & ~own
+
+        control[color] = attacked
+        mobility[color] = moves
+
+    return {
+        color: (mobility[color] + chess.popcount(king_targets[color] & ~control[not color]), control[color])
+        for color in chess.COLORS
+    }
+
+def count_legal_mobility(board):
+    """Return the exact number of legal moves of (White, Black)."""
     # Get mobility for white
     if board.turn == chess.WHITE:
         white_mobility = len(list(board.legal_moves))
@@ -145,7 +208,7 @@ def evaluate_mobility(board) -> str:
         board_copy = board.copy()
         board_copy.turn = chess.WHITE
         white_mobility = len(list(board_copy.legal_moves))
-    
+
     # Get mobility for black
     if board.turn == chess.BLACK:
         black_mobility = len(list(board.legal_moves))
@@ -154,53 +217,104 @@ def evaluate_mobility(board) -> str:
         board_copy = board.copy()
         board_copy.turn = chess.BLACK
         black_mobility = len(list(board_copy.legal_moves))
-    
-    # Calculate the mobility difference
-    mobility_diff = white_mobility - black_mobility
-    
-    # Return the mobility evaluation
-    if mobility_diff > 0:
-        return "Mobility: Adv for White"
-    elif mobility_diff < 0:
-        return "Mobility: Adv for Black"
-    else:
-        return "Mobility: Even"
-
-def evaluate_space_control(board) -> str:
-    # Define central squares
-    central_squares = {chess.D4, chess.E4, chess.D5, chess.E5}
-    
-    # Initialize control counters
-    white_central_control = 0
-    black_central_control = 0
-    white_non_central_control = 0
-    black_non_central_control = 0
-    
-    # Evaluate control for all squares
-    for square in chess.SQUARES:
-        is_central = square in central_squares
-        
-        if board.is_attacked_by(chess.WHITE, square):
-            if is_central:
-                white_central_control += 1
-            else:
-                white_non_central_control += 1
-        
-        if board.is_attacked_by(chess.BLACK, square):
-            if is_central:
-                black_central_control += 1
+
+    return white_mobility, black_mobility
+
+def count_mobility(board, exact=False, summary=None):
+    """
+    Return the mobility of (White, Black): pseudo-legal from attack masks, or legal moves if `exact`.
+
+    Legal moves are also counted when the side to move is in check, where most
+    pseudo-legal moves do not get out of it. `summary` is a precomputed `attack_summary`.
+    """
+    if exact or board.is_check():
+        return count_legal_mobility(board)
+    summary = summary if summary is not None else attack_summary(board)
+    return summary[chess.WHITE][0], summary[chess.BLACK][0]
+
+def evaluate_mobility_score(board, exact=False, summary=None):
+    """Return the mobility balance in centipawns (positive favours White)."""
+    white_mobility, black_mobility = count_mobility(board, exact=exact, summary=summary)
+    return MOBILITY_WEIGHT * (white_mobility - black_mobility)
+
+def control_score(control_mask):
+    """Score a control bitboard: central squares count twice, other squares once."""
+    return chess.popcount(control_mask) + chess.popcount(control_mask & CENTRAL_SQUARES)
+
+def count_space_control(board, summary=None):
+    """Return the square control scores of (White, Black); central squares count twice."""
+    summary = summary if summary is not None else attack_summary(board)
+    return control_score(summary[chess.WHITE][1]), control_score(summary[chess.BLACK][1])
+
+def evaluate_space_control_score(board, summary=None):
+    """Return the square control balance in centipawns (positive favours White)."""
+    white_score, black_score = count_space_control(board, summary=summary)
+    return SPACE_CONTROL_WEIGHT * (white_score - black_score)
+
+# Terms that take a shared `attack_summary`, so it is computed once per evaluation
+ATTACK_SUMMARY_TERMS = (evaluate_mobility_score, evaluate_space_control_score)
+
+# Numeric evaluation terms, in the order they are shown in the GUI
+EVALUATION_TERMS = {
+    "material": evaluate_material_score,
+    "position": evaluate_position_score,
+    "mobility": evaluate_mobility_score,
+    "space_control": evaluate_space_control_score,
+}
+
+def evaluate(board, terms=EVALUATION_TERMS, exact_mobility=False):
+    """
+    Evaluate a position numerically.
+
+    Args:
+        board (chess.Board): The position to evaluate.
+        terms (dict): Term name -> scoring function; defaults to all Sapientia terms.
+        exact_mobility (bool): Count legal moves for mobility instead of attack-mask moves.
+
+    Returns:
+        dict: Centipawn score of each term and their sum under "total", all from White's point of view.
+    """
+    scores = {}
+    summary = None
+    for name, term in terms.items():
+        if term in ATTACK_SUMMARY_TERMS:
+            if summary is None:
+                summary = attack_summary(board)
+            if term is evaluate_mobility_score:
+                scores[name] = term(board, exact=exact_mobility, summary=summary)
             else:
-                black_non_central_control += 1
-    
-    # Calculate scores
-    white_score = white_central_control * 2 + white_non_central_control
-    black_score = black_central_control * 2 + black_non_central_control
-    
-    # Overall evaluation
-    control_diff = white_score - black_score
-    if control_diff > 0:
-        return "Square Control: Adv for White"
-    elif control_diff < 0:
-        return "Square Control: Adv for Black"
+                scores[name] = term(board, summary=summary)
+        else:
+            scores[name] = term(board)
+    scores["total"] = sum(scores.values())
+    return scores
+
+def _verdict(label, diff):
+    """Turn a score difference into the "Adv for White/Black" text shown in the GUI."""
+    if diff > 0:
+        return f"{label}: Adv for White"
+    elif diff < 0:
+        return f"{label}: Adv for Black"
     else:
-        return "Square Control: Even"
\ No newline at end of file
+        return f"{label}: Even"
+
+def evaluate_material(board):
+    """Evaluate the material balance of the board."""
+    return _verdict("Material", evaluate_material_score(board))
+
+def evaluate_position(board):
+    """Evaluate the positional difference between white and black."""
+    return _verdict("Position", evaluate_position_score(board))
+
+def evaluate_mobility(board, exact=True, summary=None) -> str:
+    """
+    Evaluate the mobility of both players.
+
+    The verdict is shown to users, so legal moves are counted by default; the fast
+    attack-mask count (`exact=False`) disagrees on who has more moves in about 2% of positions.
+    """
+    return _verdict("Mobility", evaluate_mobility_score(board, exact=exact, summary=summary))
+
+def evaluate_space_control(board, summary=None) -> str:
+    """Evaluate the control of central and non-central squares."""
+    return _verdict("Square Control", evaluate_space_control_score(board, summary=summary))
@@ -1,16 +1,260 @@
-import requests
+import os
 import re
+import json
+import time
+import sqlite3
+import threading
+import concurrent.futures
+import chess
+import requests
+from requests.adapters import HTTPAdapter
+from tracing import span
+
+# URL of the Lichess masters explorer (override with SAPIENTIA_EXPLORER_URL, e.g. for a local stand-in)
+EXPLORER_URL = os.environ.get("SAPIENTIA_EXPLORER_URL", "https://explorer.lichess.ovh/master")
+
+# Local opening index answered before the online explorer (SAPIENTIA_OPENING_INDEX, see opening_explorer.py)
+LOCAL_INDEX_PATH = os.environ.get("SAPIENTIA_OPENING_INDEX", "")
+
+# On-disk cache of explorer responses (override with SAPIENTIA_EXPLORER_CACHE)
+EXPLORER_CACHE_PATH = os.environ.get(
+    "SAPIENTIA_EXPLORER_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "sapientia", "explorer.sqlite3"))
+
+# Seconds a cached response stays valid; the masters database changes rarely
+EXPLORER_CACHE_TTL = 7 * 24 * 3600
+
+# Hard limit in seconds on one lookup, retries and backoff included
+REQUEST_TIMEOUT = 5.0
+
+# Attempts per lookup when the explorer answers HTTP 429 (Too Many Requests)
+MAX_ATTEMPTS = 3
+
+# Seconds to back off after the first 429 when the response has no Retry-After; doubled per attempt
+BACKOFF_BASE = 1.0
+
+# Keep-alive connections kept open to the explorer
+POOL_SIZE = 4
+
+# Seconds a writer waits for another process holding the cache database lock
+BUSY_TIMEOUT = 30.0
+
+
+def normalize_fen(fen):
+    """Return the EPD of a FEN, so positions differing only in move counters share a cache entry."""
+    return chess.Board(fen).epd()
+
+
+class ExplorerCache:
+    """SQLite cache of explorer responses with a time-to-live, keyed by URL and normalized FEN."""
+
+    def __init__(self, path=EXPLORER_CACHE_PATH, ttl=EXPLORER_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS explorer_responses (
+                    url TEXT NOT NULL,
+                    epd TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    fetched REAL NOT NULL,
+                    PRIMARY KEY (url, epd)
+                )
+            """)
+
+    def _connection(self):
+        """Return this thread's connection; sqlite3 connections cannot be shared across threads."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, url, epd):
+        """Return the cached response, or None if there is none younger than the TTL."""
+        row = self._connection().execute(
+            "SELECT response FROM explorer_responses WHERE url = ? AND epd = ? AND fetched >= ?",
+            (url, epd, time.time() - self.ttl)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, url, epd, data):
+        """Store a response, replacing any older one."""
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO explorer_responses (url, epd, response, fetched) VALUES (?, ?, ?, ?)",
+                (url, epd, json.dumps(data, separators=(",", ":")), time.time()))
+
+    def close(self):
+        """Close this thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
 
-# Function to fetch GM data from Lichess
+class ExplorerClient:
+    """
+    Client for the Lichess masters explorer.
+
+    Requests go through one keep-alive session, so consecutive moves reuse the
+    TLS connection. Responses are cached on disk (see `ExplorerCache`), and
+    concurrent lookups of the same position share a single request. When the
+    explorer answers HTTP 429, every lookup backs off (honouring Retry-After)
+    until the throttle lifts, and no lookup takes longer than `timeout` seconds.
+    """
+
+    def __init__(self, url=EXPLORER_URL, cache=None, timeout=REQUEST_TIMEOUT,
+                 max_attempts=MAX_ATTEMPTS, backoff=BACKOFF_BASE, pool_size=POOL_SIZE):
+        self.url = url
+        self.cache = cache
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # Monotonic time before which no request is sent, after a 429
+        self._throttled_until = 0.0
+        self.requests = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+
+    def fetch(self, fen):
+        """
+        Look up a position in the explorer.
+
+        Args:
+            fen (str): The position in FEN notation.
+
+        Returns:
+            dict: The explorer's JSON response ("moves", "topGames", ...), or an empty
+            dict if the lookup failed or timed out.
+        """
+        with span("gm.explorer") as span_args:
+            return self._fetch(fen, span_args)
+
+    def _fetch(self, fen, span_args):
+        epd = normalize_fen(fen)
+        if self.cache is not None:
+            cached = self.cache.get(self.url, epd)
+            if cached is not None:
+                self.cache_hits += 1
+                span_args["cache"] = "hit"
+                return cached
+        span_args["cache"] = "miss"
+
+        with self._lock:
+            future = self._inflight.get(epd)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._inflight[epd] = future
+            else:
+                self.coalesced += 1
+        if not owner:
+            span_args["cache"] = "coalesced"
+            try:
+                return future.result(timeout=self.timeout)
+            except concurrent.futures.TimeoutError:
+                span_args["outcome"] = "timeout"
+                return {}
+
+        try:
+            data = self._request(fen)
+        except Exception as e:
+            print(f"Failed to fetch GM data: {e}")
+            data = None
+        finally:
+            with self._lock:
+                del self._inflight[epd]
+        if data is None:
+            span_args["outcome"] = "error"
+        elif self.cache is not None:
+            self.cache.put(self.url, epd, data)
+        future.set_result(data if data is not None else {})
+        return future.result()
+
+    def _request(self, fen):
+        """Send the request, backing off on HTTP 429. Returns the JSON data, or None on failure."""
+        deadline = time.monotonic() + self.timeout
+        for attempt in range(self.max_attempts):
+            wait = self._throttled_until - time.monotonic()
+            if wait > 0:
+                if time.monotonic() + wait >= deadline:
+                    print("Failed to fetch GM data: rate limited by the explorer")
+                    return None
+                time.sleep(wait)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            self.requests += 1
+            response = self.session.get(self.url, params={"fen": fen}, timeout=remaining)
+            if response.status_code == 429:
+                self._throttle(response, attempt)
+                continue
+            if response.status_code == 200:
+                return response.json()
+            print(f"Failed to fetch GM data. Status code: {response.status_code}")
+            return None
+        print("Failed to fetch GM data: still rate limited or out of time")
+        return None
+
+    def _throttle(self, response, attempt):
+        """Hold back every request until the explorer's rate limit lifts."""
+        try:
+            delay = float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            delay = self.backoff * 2 ** attempt
+        with self._lock:
+            self._throttled_until = max(self._throttled_until, time.monotonic() + delay)
+
+    def close(self):
+        self.session.close()
+
+
+_explorer_client = None
+_explorer_client_lock = threading.Lock()
+
+
+def get_explorer_client():
+    """Return the shared explorer client, with the on-disk cache at EXPLORER_CACHE_PATH."""
+    global _explorer_client
+    with _explorer_client_lock:
+        if _explorer_client is None:
+            try:
+                cache = ExplorerCache()
+            except (sqlite3.Error, OSError) as e:
+                print(f"Explorer cache unavailable: {e}")
+                cache = None
+            _explorer_client = ExplorerClient(cache=cache)
+        return _explorer_client
+
+
+# Function to fetch GM data, from the local opening index if one is configured, else from Lichess
 def fetch_gm_data(fen):
-    url = f"https://explorer.lichess.ovh/master?fen={fen}"
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        return response.json()  # Return the JSON data if successful
-    else:
-        print(f"Failed to fetch GM data. Status code: {response.status_code}")
-        return {}
+    index = None
+    if LOCAL_INDEX_PATH:
+        try:
+            # Imported here, so numpy is only needed when a local index is configured
+            from opening_explorer import get_local_explorer
+            index = get_local_explorer(LOCAL_INDEX_PATH)
+        except (ImportError, OSError, ValueError) as e:
+            print(f"Local opening index unavailable: {e}")
+    if index is not None:
+        with span("gm.local_index") as span_args:
+            data = index.lookup(fen)
+            span_args["cache"] = "hit" if data["moves"] else "miss"
+        # Positions past the indexed plies fall back to the online explorer
+        if data["moves"]:
+            return data
+    return get_explorer_client().fetch(fen)
 
 # Function to extract best move and top GM games
 def process_gm_data(data):
@@ -8,17 +8,21 @@ from IPython.display import display, SVG, clear_output, Audio, Javascript
 import ipywidgets as widgets
 import threading
 import concurrent.futures
-from openings import process_moves, uci_to_san, check_openings, get_user_moves
-from gm_database import fetch_gm_data, process_gm_data
-from engines import fetch_komodo_data, fetch_stockfish_data
-from endgame import fetch_endgame_tablebase_data, best_endgame_move
+from openings import uci_to_san
+from analysis import run_analysis, ANALYSIS_SOURCES, ENGINE_TIMEOUT_MARGIN
+from cache import AnalysisCache
+from prefetch import PreAnalysisScheduler
+from tracing import Trace, span, use_trace, current_trace
 from evaluation import evaluate_material, evaluate_position, evaluate_space_control, evaluate_mobility
 
+# Seconds the analysis of a move may take; engines stop at the deadline with their best move so far
+LATENCY_TARGET = 3.0
+
 class ChessGUI:
-    def __init__(self):
+    def __init__(self, latency_target=LATENCY_TARGET, debug=False):
         # Board and caching
         self.board = chess.Board()
-        self.fen_cache = {}
+        self.analysis_cache = AnalysisCache()
         self.previous_fen = None
         self.is_initial_render = True
 
@@ -29,6 +33,21 @@ class ChessGUI:
         # Thread pool for asynchronous tasks
         self.executor = concurrent.futures.ThreadPoolExecutor()
 
+        # Key of the current game; engines get "ucinewgame" when it changes on reset
+        self.game = object()
+
+        # Background analysis of the current position; set the event to cancel it
+        self.analysis_cancel_event = None
+        self.analysis_lock = threading.Lock()
+        self.latency_target = latency_target
+
+        # Per-stage timings of the latest analysis; `debug` adds them to the table
+        self.debug = debug
+        self.last_trace = None
+
+        # Speculative analysis of the likely next positions, filling the analysis cache
+        self.prefetcher = PreAnalysisScheduler(self.analysis_cache, deadline=latency_target)
+
         # GUI elements
         self.input_box = widgets.Text(
             placeholder='Enter your move or command', description='Command:')
@@ -36,6 +55,7 @@ class ChessGUI:
         self.reset_button = widgets.Button(description="Reset")
         self.undo_button = widgets.Button(description="Undo")
         self.output_area = widgets.Output()
+        self.analysis_table = widgets.HTML()
         self.chessboard_output = widgets.Output()
         self.button_layout = widgets.HBox(
             [self.submit_button, self.reset_button, self.undo_button])
@@ -48,10 +68,13 @@ class ChessGUI:
         # Attach event handlers
         self.submit_button.on_click(self.on_submit_click)
         self.reset_button.on_click(self.on_reset_click)
+        self.undo_button.on_click(self.on_undo_click)
 
         # Render initial board
         self.render_board(
             game_start_sound="/content/sample_data/sounds/game_start.mp3")
+        with self.output_area:
+            display(self.analysis_table)
         display(self.layout_container)
 
     def _style_buttons(self):
@@ -61,15 +84,9 @@ class ChessGUI:
             button.layout.height = '20px'
             button.style.font = 'Arial 5pt'
 
-    def dynamic_depth(self):
-        """Dynamically adjust engine depth based on the number of pieces."""
-        piece_count = len(self.board.piece_map())
-        if piece_count > 16:
-            return 6
-        elif piece_count > 8:
-            return 8
-        else:
-            return 12
+    def analysis_limit(self):
+        """Engine time budget that keeps each move's analysis within the latency target."""
+        return chess.engine.Limit(time=max(0.1, self.latency_target - ENGINE_TIMEOUT_MARGIN))
 
     def render_board(self, scale=0.6, game_start_sound=None, move_sound=None, hide_controls=True):
         """Render the chessboard."""
@@ -104,50 +121,79 @@ class ChessGUI:
             print(f"Error playing sound: {e}")
 
     def fetch_and_process(self, fen):
-        """Fetch and process data with caching."""
-        if fen in self.fen_cache:
-            return self.fen_cache[fen]
-
-        gm_data = fetch_gm_data(fen)
-        best_move_uci, _, _, _, top_games = process_gm_data(gm_data)
-
-        depth = self.dynamic_depth()
-        best_move_stockfish = fetch_stockfish_data(
-            fen, depth=depth) or "No best move available"
-        best_move_komodo = fetch_komodo_data(
-            fen, depth=depth) or "No best move available"
-        best_move_syzygy = best_endgame_move(
-            fen, turn="white" if self.board.turn else "black") or "No endgame move available"
-
-        opening_matches = check_openings(get_user_moves(self.board))
-        endgame_data = fetch_endgame_tablebase_data(fen)
-        wdl = endgame_data.get("WDL", "N/A")
-        dtz = endgame_data.get("DTZ", "N/A")
-
-        data = {
-            "best_move_uci": best_move_uci,
-            "top_games": top_games,
-            "best_move_stockfish": best_move_stockfish,
-            "best_move_komodo": best_move_komodo,
-            "best_move_syzygy": best_move_syzygy,
-            "wdl": wdl,
-            "dtz": dtz,
-            "opening_matches": opening_matches
-        }
-        self.fen_cache[fen] = data
-        return data
+        """Fetch and process data with caching, querying all sources concurrently."""
+        board = self.board if self.board.fen() == fen else chess.Board(fen)
+        trace = self.last_trace = Trace()
+        with use_trace(trace):
+            return run_analysis(board, self.analysis_limit(), self.executor, deadline=self.latency_target,
+                                cache=self.analysis_cache, trace=trace, game=self.game)
+
+    def cancel_analysis(self):
+        """Cancel the background analysis and pre-analysis of the previous position, if any."""
+        self.prefetcher.cancel()
+        with self.analysis_lock:
+            if self.analysis_cancel_event is not None:
+                self.analysis_cancel_event.set()
+                self.analysis_cancel_event = None
+
+    def start_analysis(self, trace=None):
+        """
+        Analyse the current position in the background.
+
+        The table is drawn right away with pending rows, and each row is filled in
+        as its source finishes. Starting a new analysis cancels the previous one.
+        Once it completes, the likely next positions are pre-analysed into the cache.
+        Its stages are timed in `trace` (a new trace by default), kept as `last_trace`.
+        """
+        self.cancel_analysis()
+        trace = trace if trace is not None else Trace()
+        self.last_trace = trace
+        fen = self.board.fen()
+        cancel_event = threading.Event()
+        with self.analysis_lock:
+            self.analysis_cancel_event = cancel_event
+        board = self.board.copy()
+        limit = self.analysis_limit()
+        game = self.game
+        data = {}
+        with use_trace(trace):
+            self.display_best_moves_and_analysis(data, fen)
+
+        def on_result(name, partial):
+            with self.analysis_lock:
+                if cancel_event.is_set():
+                    return
+                data.update(partial)
+                self.display_best_moves_and_analysis(data, fen)
+
+        def analyse():
+            with use_trace(trace):
+                result = run_analysis(board, limit, self.executor, deadline=self.latency_target, on_result=on_result,
+                                      cancel_event=cancel_event, cache=self.analysis_cache, trace=trace, game=game)
+                with self.analysis_lock:
+                    if cancel_event.is_set():
+                        return
+                    self.display_best_moves_and_analysis(result, fen)
+            self.prefetcher.schedule(board, result, limit, game=game)
+
+        threading.Thread(target=analyse, daemon=True).start()
 
     def display_best_moves_and_analysis(self, data, fen):
-        """Display analysis data in a table format."""
+        """Display analysis data in a table format. Missing entries are shown as pending."""
         uci_sequence = " ".join(self.current_uci_sequence)
         san_sequence = " ".join(self.current_san_sequence)
         board = chess.Board(fen)
-        material = evaluate_material(board)
-        position = evaluate_position(board)
-        mobility = evaluate_mobility(board)
-        space_control = evaluate_space_control(board)
+        with span("gui.evaluation"):
+            material = evaluate_material(board)
+            position = evaluate_position(board)
+            mobility = evaluate_mobility(board)
+            space_control = evaluate_space_control(board)
         evaluations = f"{material}, {position}, {mobility}, {space_control}"
 
+        # Sources that have not answered yet are shown as pending
+        pending = "Pending..."
+        data = {key: pending for _, keys, _ in ANALYSIS_SOURCES.values() for key in keys} | data
+
         table_rows = [
             ("Current FEN:", fen),
             ("Current UCI Sequence:", uci_sequence),
@@ -159,10 +205,17 @@ class ChessGUI:
             ("Top Games with Best Move:", data["top_games"] or "No GM games found"),
             ("Best Move from Stockfish:", data["best_move_stockfish"]),
             ("Best Move from Komodo:", data["best_move_komodo"]),
+            ("Best Move from Sapientia:", data["best_move_sapientia"]),
             ("Best Endgame Move from Syzygy:", data["best_move_syzygy"]),
             ("WDL (Win/Draw/Loss):", data["wdl"]),
             ("DTZ (Depth to Zero):", data["dtz"]),
+            ("Timed Out Sources:", ", ".join(data["timed_out"]) if "timed_out" in data else pending),
+            ("Analysis Time:", f"{data['elapsed']:.2f}s" if "elapsed" in data else pending),
         ]
+        trace = current_trace() or self.last_trace
+        if self.debug and trace is not None:
+            timings = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in trace.durations().items())
+            table_rows.append(("Stage Timings:", timings or pending))
 
         table_html = "<table style='border-collapse: collapse; width: 100%; margin: 0 auto; font-size: 10px;'>"
         table_html += """
@@ -181,20 +234,33 @@ class ChessGUI:
             """
         table_html += "</table>"
 
-        with self.output_area:
-            clear_output(wait=True)
-            display(widgets.HTML(value=table_html))
+        # Updating the widget value is safe from the background analysis thread
+        self.analysis_table.value = table_html
+
+    def reset_game(self):
+        """Start a new game: cancel the analysis, reset the board and give the engines a fresh game key."""
+        self.cancel_analysis()
+        self.board.reset()
+        self.game = object()
 
     def process_command(self, msg):
         """Process user commands."""
         msg = msg.strip().lower()
         if msg == "reset":
-            self.board.reset()
+            self.reset_game()
             self.render_board(game_start_sound="/content/sample_data/sounds/game_start.mp3")
         elif msg == "undo":
+            self.cancel_analysis()
             if self.board.move_stack:
                 self.board.pop()
-            self.render_board()
+            trace = Trace()
+            with use_trace(trace):
+                self.current_uci_sequence = [move.uci() for move in self.board.move_stack]
+                with span("gui.uci_to_san"):
+                    self.current_san_sequence = uci_to_san(self.current_uci_sequence)
+                with span("gui.render_board"):
+                    self.render_board()
+                self.start_analysis(trace)
         elif msg == "quit":
             sys.exit()
         else:
@@ -207,14 +273,17 @@ class ChessGUI:
                 move = chess.Move.from_uci(msg)
                 if move in self.board.legal_moves:
                     self.board.push(move)  # Push the move first
-                    self.current_uci_sequence = [move.uci() for move in self.board.move_stack]
-                    self.current_san_sequence = uci_to_san(self.current_uci_sequence)  # Convert UCI to SAN
+                    trace = Trace()
+                    with use_trace(trace):
+                        self.current_uci_sequence = [move.uci() for move in self.board.move_stack]
+                        with span("gui.uci_to_san"):
+                            self.current_san_sequence = uci_to_san(self.current_uci_sequence)  # Convert UCI to SAN
 
-                    self.render_board(move_sound="/content/sample_data/sounds/move.mp3")
+                        with span("gui.render_board"):
+                            self.render_board(move_sound="/content/sample_data/sounds/move.mp3")
 
-                    fen = self.board.fen()
-                    data = self.fetch_and_process(fen)  # Fetch data for the new position
-                    self.display_best_moves_and_analysis(data, fen)  # Display analysis
+                        # Analyse the new position in the background, without blocking the widgets
+                        self.start_analysis(trace)
                 else:
                     print(f"Illegal move: {msg}")
             except ValueError as e:
@@ -229,6 +298,8 @@ class ChessGUI:
 
     def on_reset_click(self, _):
         """Handle reset button click."""
-        self.board.reset()
-        self.render_board(
-            game_start_sound="/content/sample_data/sounds/game_start.mp3")
+        self.process_command("reset")
+
+    def on_undo_click(self, _):
+        """Handle undo button click."""
+        self.process_command("undo")
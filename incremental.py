@@ -0,0 +1,102 @@
+import chess
+from evaluation import PIECE_VALUES, PIECE_SQUARE_VALUES, PHASE_WEIGHTS, evaluate_material_score, evaluate_position_score, game_phase
+
+
+def piece_scores(piece, square):
+    """Return the (material, position, phase) contribution of a piece on a square, from White's point of view."""
+    sign = 1 if piece.color == chess.WHITE else -1
+    return (sign * PIECE_VALUES[piece.piece_type],
+            sign * PIECE_SQUARE_VALUES[piece.color][piece.piece_type][square],
+            PHASE_WEIGHTS[piece.piece_type])
+
+
+class IncrementalEvaluator:
+    """
+    Keep running material, piece-square and phase totals for a board across push/pop.
+
+    A move only changes the squares it touches (two for a normal move, three for
+    en passant, four for castling), so each push computes the delta over those
+    squares and each pop reverts it. With `debug=True`, every update is checked
+    against a full evaluation from evaluation.py.
+    """
+
+    def __init__(self, board=None, debug=False):
+        self.board = board.copy() if board is not None else chess.Board()
+        self.debug = debug
+        self._deltas = []
+        self.refresh()
+
+    def refresh(self):
+        """Recompute the totals from scratch, e.g. after the board was changed directly."""
+        self.material = evaluate_material_score(self.board)
+        self.position = evaluate_position_score(self.board)
+        self.phase = game_phase(self.board)
+        self._deltas.clear()
+
+    def _touched_squares(self, move):
+        """Return the squares whose contents change when `move` is played."""
+        squares = {move.from_square, move.to_square}
+        if self.board.is_en_passant(move):
+            # The captured pawn stands behind the target square
+            squares.add(move.to_square + (-8 if self.board.turn == chess.WHITE else 8))
+        elif self.board.is_castling(move):
+            # The rook moves along the back rank as well
+            squares.update(chess.SquareSet(chess.BB_RANK_1 if self.board.turn == chess.WHITE else chess.BB_RANK_8))
+        return squares
+
+    def _totals(self, squares):
+        """Sum the (material, position, phase) contributions of the pieces on `squares`."""
+        material = position = phase = 0
+        for square in squares:
+            piece = self.board.piece_at(square)
+            if piece is not None:
+                m, p, ph = piece_scores(piece, square)
+                material += m
+                position += p
+                phase += ph
+        return material, position, phase
+
+    def push(self, move):
+        """Play a move, updating the totals by the change on the squares it touches."""
+        squares = self._touched_squares(move)
+        before = self._totals(squares)
+        self.board.push(move)
+        after = self._totals(squares)
+        delta = (after[0] - before[0], after[1] - before[1], after[2] - before[2])
+        self._apply(delta)
+        self._deltas.append(delta)
+        return delta
+
+    def push_uci(self, uci):
+        """Play a move given in UCI notation."""
+        return self.push(chess.Move.from_uci(uci))
+
+    def pop(self):
+        """Take back the last move, reverting its delta."""
+        move = self.board.pop()
+        if self._deltas:
+            delta = self._deltas.pop()
+            self._apply((-delta[0], -delta[1], -delta[2]))
+        else:
+            # The move was played before the evaluator was created
+            self.refresh()
+        return move
+
+    def _apply(self, delta):
+        self.material += delta[0]
+        self.position += delta[1]
+        self.phase += delta[2]
+        if self.debug:
+            self.check()
+
+    def check(self):
+        """Raise AssertionError if the running totals differ from a full evaluation."""
+        expected = (evaluate_material_score(self.board), evaluate_position_score(self.board), game_phase(self.board))
+        actual = (self.material, self.position, self.phase)
+        if actual != expected:
+            raise AssertionError(
+                f"Incremental evaluation {actual} differs from full evaluation {expected} for {self.board.fen()}")
+
+    def scores(self):
+        """Return the running totals as a dict, from White's point of view."""
+        return {"material": self.material, "position": self.position, "phase": self.phase}
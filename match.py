@@ -0,0 +1,325 @@
+import os
+import sys
+import math
+import time
+import random
+import argparse
+import multiprocessing
+import concurrent.futures
+from contextlib import ExitStack
+import chess
+import chess.pgn
+import chess.engine
+from openings import load_openings
+from engines import get_engine_pool, STOCKFISH_PATH, KOMODO_PATH
+from endgame import probe_endgame, count_pieces, MAX_TABLEBASE_PIECES
+from sapientia_engine import SapientiaEngine, TranspositionTable
+
+# Games played at the same time (one worker process each)
+DEFAULT_CONCURRENCY = os.cpu_count() or 1
+
+# Seconds per move when a player gives no depth, time or node budget
+DEFAULT_MOVE_TIME = 0.1
+
+# Games still going after this many moves are adjudicated as draws
+DEFAULT_MAX_MOVES = 200
+
+# Book openings shorter than this many plies are not used as starting positions
+BOOK_MIN_PLIES = 4
+
+# Engine processes per binary in each worker; two, so an engine can play itself
+ENGINES_PER_WORKER = 2
+
+# Tablebase categories that settle a game; others ("maybe-win", "unknown", ...) are played on
+DRAWN_CATEGORIES = ("draw", "cursed-win", "blessed-loss")
+
+# Engines a player can use; "sapientia" runs in-process
+ENGINE_NAMES = ("stockfish", "komodo", "sapientia")
+
+
+def parse_player(spec, paths=None):
+    """
+    Parse a player given as "engine[,key=value...]", e.g. "stockfish,depth=10" or "sapientia,nodes=20000".
+
+    Keys are "depth", "time" (seconds per move), "nodes", "name" (as shown in the
+    PGN; defaults to `spec`) and "path" (UCI binary, overriding the engine's default).
+
+    Args:
+        paths (dict): Engine name -> default UCI binary path.
+
+    Returns:
+        dict: "name", "engine", "path" (None for Sapientia) and "limit" ({"depth", "time", "nodes"}).
+
+    Raises:
+        ValueError: If the engine or an option is unknown, or a budget is not a number.
+    """
+    if paths is None:
+        paths = {"stockfish": STOCKFISH_PATH, "komodo": KOMODO_PATH}
+    engine, *options = spec.split(",")
+    if engine not in ENGINE_NAMES:
+        raise ValueError(f"Unknown engine {engine!r} in player {spec!r}")
+    player = {"name": spec, "engine": engine, "path": paths.get(engine),
+              "limit": {"depth": None, "time": None, "nodes": None}}
+    for option in options:
+        key, _, value = option.partition("=")
+        if key == "depth" or key == "nodes":
+            player["limit"][key] = int(value)
+        elif key == "time":
+            player["limit"][key] = float(value)
+        elif key == "name" or key == "path":
+            player[key] = value
+        else:
+            raise ValueError(f"Unknown option {key!r} in player {spec!r}")
+    if engine == "sapientia":
+        player["path"] = None
+    if not any(player["limit"].values()):
+        player["limit"]["time"] = DEFAULT_MOVE_TIME
+    return player
+
+
+def load_book(min_plies=BOOK_MIN_PLIES):
+    """
+    Return the distinct openings of the Lichess openings data with at least `min_plies` moves.
+
+    Returns:
+        list: {"name", "uci"} dicts, or a single start-position entry if the openings cannot be loaded.
+    """
+    try:
+        entries = load_openings()
+    except Exception as e:
+        print(f"Error while loading the openings dataset: {e}", file=sys.stderr)
+        entries = []
+    book = {}
+    for entry in entries:
+        if len(entry["uci"].split()) >= min_plies:
+            book.setdefault(entry["uci"], {"name": entry["name"], "uci": entry["uci"]})
+    if not book:
+        return [{"name": "Starting position", "uci": ""}]
+    return list(book.values())
+
+
+def tablebase_result(category, turn):
+    """
+    Return the PGN result of a tablebase category ("win", "draw", ...) for the side to move.
+
+    Returns None for categories that do not settle the game, such as "maybe-win" or "unknown".
+    """
+    if category == "win":
+        return "1-0" if turn == chess.WHITE else "0-1"
+    if category == "loss":
+        return "0-1" if turn == chess.WHITE else "1-0"
+    # Cursed wins and blessed losses are draws under the 50-move rule
+    if category in DRAWN_CATEGORIES:
+        return "1/2-1/2"
+    return None
+
+
+def play_game(round_number, white, black, opening, max_moves=DEFAULT_MAX_MOVES, adjudicate=True):
+    """
+    Play one game from a book opening (run in a worker process).
+
+    UCI engines come from the worker's engine pools, so they stay warm between
+    games; each game starts with "ucinewgame". Sapientia gets a fresh
+    transposition table per side and game. With `adjudicate`, positions with
+    at most MAX_TABLEBASE_PIECES pieces end the game with the tablebase result,
+    unless the tablebase cannot settle it (see `tablebase_result`).
+
+    Args:
+        round_number (int): Number of the game in the match, for the PGN.
+        white (dict), black (dict): Players, see `parse_player`.
+        opening (dict): Book opening, see `load_book`.
+        max_moves (int): Moves after which the game is adjudicated as a draw.
+        adjudicate (bool): End games with the Syzygy tablebase result.
+
+    Returns:
+        dict: "round", "white", "black", "result" ("1-0", "0-1" or "1/2-1/2"),
+        "termination", "opening", "plies" and "pgn" (the game as PGN text).
+    """
+    board = chess.Board()
+    for uci in opening["uci"].split():
+        board.push_uci(uci)
+    players = {chess.WHITE: white, chess.BLACK: black}
+    tables = {chess.WHITE: TranspositionTable(), chess.BLACK: TranspositionTable()}
+    game_key = object()
+    result = termination = None
+
+    with ExitStack() as stack:
+        engines = {}
+        for color, player in players.items():
+            if player["path"] is not None:
+                pool = get_engine_pool(player["path"], size=ENGINES_PER_WORKER)
+                engines[color] = stack.enter_context(pool.engine())
+
+        while result is None:
+            outcome = board.outcome(claim_draw=True)
+            if outcome is not None:
+                result, termination = outcome.result(), outcome.termination.name.lower().replace("_", " ")
+                break
+            if adjudicate and count_pieces(board.fen()) <= MAX_TABLEBASE_PIECES:
+                probe = probe_endgame(board.fen())
+                if "Error" in probe:
+                    # Don't wait on a tablebase that cannot answer for every remaining move
+                    adjudicate = False
+                else:
+                    result = tablebase_result(probe["category"], board.turn)
+                    if result is not None:
+                        termination = "tablebase"
+                        break
+            if board.fullmove_number > max_moves:
+                result, termination = "1/2-1/2", "max moves"
+                break
+
+            player = players[board.turn]
+            limit = player["limit"]
+            if player["path"] is None:
+                move = SapientiaEngine(tables[board.turn]).search(
+                    board.copy(), depth=limit["depth"], time_limit=limit["time"], node_limit=limit["nodes"])["move"]
+                move = chess.Move.from_uci(move)
+            else:
+                move = engines[board.turn].play(board, chess.engine.Limit(**limit), game=game_key).move
+            board.push(move)
+
+    game = chess.pgn.Game.from_board(board)
+    game.headers["Event"] = "Sapientia match"
+    game.headers["Site"] = "?"
+    game.headers["Date"] = time.strftime("%Y.%m.%d")
+    game.headers["Round"] = str(round_number)
+    game.headers["White"] = white["name"]
+    game.headers["Black"] = black["name"]
+    game.headers["Result"] = result
+    game.headers["Opening"] = opening["name"]
+    game.headers["Termination"] = termination
+    return {
+        "round": round_number,
+        "white": white["name"],
+        "black": black["name"],
+        "result": result,
+        "termination": termination,
+        "opening": opening["name"],
+        "plies": board.ply(),
+        "pgn": str(game),
+    }
+
+
+def elo_difference(wins, draws, losses):
+    """
+    Return the Elo difference implied by a match score, with the half-width of its 95% confidence interval.
+
+    Returns:
+        tuple: (elo, error); infinite when one side scored every point, (None, None) without games.
+    """
+    games = wins + draws + losses
+    if not games:
+        return None, None
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+
+    def to_elo(fraction):
+        if fraction <= 0:
+            return -math.inf
+        if fraction >= 1:
+            return math.inf
+        return -400 * math.log10(1 / fraction - 1)
+
+    low, high = to_elo(score - margin), to_elo(score + margin)
+    return to_elo(score), (high - low) / 2 if math.isfinite(high - low) else math.inf
+
+
+def run_match(player_a, player_b, games, pgn_path, book=None, concurrency=DEFAULT_CONCURRENCY,
+              max_moves=DEFAULT_MAX_MOVES, adjudicate=True, seed=None):
+    """
+    Play a match between two players on a process pool and append every game to a PGN file as it ends.
+
+    Book openings are drawn at random, and each one is played twice with the
+    colours reversed, so neither player benefits from a lopsided opening.
+
+    Args:
+        player_a (dict), player_b (dict): Players, see `parse_player`.
+        games (int): Number of games.
+        pgn_path (str): PGN file the games are appended to.
+        book (list): Book openings (default: `load_book()`).
+        concurrency (int): Games played at the same time.
+        max_moves (int): Moves after which games are adjudicated as draws.
+        adjudicate (bool): End games with the Syzygy tablebase result.
+        seed (int): Seed for the choice of openings.
+
+    Returns:
+        dict: "games", "wins", "draws", "losses" (from `player_a`'s side), "elo",
+        "elo_error" (95% confidence), "elapsed" (seconds) and "games_per_hour".
+    """
+    if book is None:
+        book = load_book()
+    rng = random.Random(seed)
+    openings = rng.sample(book, min(len(book), (games + 1) // 2))
+    stats = {"games": 0, "wins": 0, "draws": 0, "losses": 0}
+    start = time.monotonic()
+
+    # Spawned rather than forked, so workers never inherit engine threads in a locked state
+    with open(pgn_path, "a", encoding="utf-8") as out, concurrent.futures.ProcessPoolExecutor(
+            max_workers=concurrency, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = []
+        for number in range(games):
+            white, black = (player_a, player_b) if number % 2 == 0 else (player_b, player_a)
+            opening = openings[(number // 2) % len(openings)]
+            futures.append(executor.submit(play_game, number + 1, white, black, opening, max_moves, adjudicate))
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                game = future.result()
+            except Exception as e:
+                print(f"Error while playing a game: {e}", file=sys.stderr)
+                continue
+            out.write(game["pgn"] + "\n\n")
+            out.flush()
+            points = {"1-0": 1.0, "0-1": 0.0}.get(game["result"], 0.5)
+            if game["white"] != player_a["name"]:
+                points = 1.0 - points
+            stats["games"] += 1
+            stats["wins" if points == 1.0 else "losses" if points == 0.0 else "draws"] += 1
+            print(f"Game {game['round']}: {game['white']} - {game['black']} {game['result']} "
+                  f"({game['termination']}), score {stats['wins']}-{stats['draws']}-{stats['losses']}")
+
+    stats["elo"], stats["elo_error"] = elo_difference(stats["wins"], stats["draws"], stats["losses"])
+    stats["elapsed"] = time.monotonic() - start
+    stats["games_per_hour"] = stats["games"] * 3600 / stats["elapsed"] if stats["elapsed"] else 0.0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Play a match between two engines, e.g. 'stockfish,depth=8' vs 'sapientia,time=0.5'.")
+    parser.add_argument("player_a", help="First player: engine[,depth=N][,time=S][,nodes=N][,name=...][,path=...]")
+    parser.add_argument("player_b", help="Second player, same format")
+    parser.add_argument("--games", type=int, default=100, help="Number of games")
+    parser.add_argument("--pgn", required=True, help="PGN file the games are appended to")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Games played at the same time")
+    parser.add_argument("--max-moves", type=int, default=DEFAULT_MAX_MOVES, help="Moves before a game is drawn")
+    parser.add_argument("--book-min-plies", type=int, default=BOOK_MIN_PLIES, help="Shortest book opening used")
+    parser.add_argument("--no-adjudication", action="store_true", help="Play endgames out instead of probing Syzygy")
+    parser.add_argument("--seed", type=int, help="Seed for the choice of openings")
+    parser.add_argument("--stockfish-path", default=STOCKFISH_PATH, help="Path of the Stockfish binary")
+    parser.add_argument("--komodo-path", default=KOMODO_PATH, help="Path of the Komodo binary")
+    args = parser.parse_args(argv)
+
+    paths = {"stockfish": args.stockfish_path, "komodo": args.komodo_path}
+    try:
+        player_a, player_b = parse_player(args.player_a, paths), parse_player(args.player_b, paths)
+    except ValueError as e:
+        parser.error(str(e))
+    if player_a["name"] == player_b["name"]:
+        player_b["name"] += " (2)"
+    for player in (player_a, player_b):
+        if player["path"] is not None and not os.path.exists(player["path"]):
+            parser.error(f"{player['name']}: {player['path']} not found")
+
+    stats = run_match(player_a, player_b, args.games, args.pgn, book=load_book(args.book_min_plies),
+                      concurrency=args.concurrency, max_moves=args.max_moves,
+                      adjudicate=not args.no_adjudication, seed=args.seed)
+    elo = "n/a" if stats["elo"] is None else f"{stats['elo']:+.1f} +/- {stats['elo_error']:.1f}"
+    print(f"{player_a['name']} vs {player_b['name']}: +{stats['wins']} ={stats['draws']} -{stats['losses']} "
+          f"in {stats['games']} games, Elo difference {elo}, {stats['games_per_hour']:.0f} games/hour")
+
+
+if __name__ == "__main__":
+    main()
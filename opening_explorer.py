@@ -0,0 +1,398 @@
+import io
+import os
+import mmap
+import json
+import shutil
+import argparse
+import threading
+import concurrent.futures
+import chess
+import chess.pgn
+import chess.polyglot
+import numpy as np
+
+# Plies of each game that are indexed
+DEFAULT_MAX_PLIES = 30
+
+# Top games kept per position, as in the Lichess masters explorer
+DEFAULT_TOP_GAMES = 15
+
+# Bytes of PGN handed to one worker at a time
+CHUNK_BYTES = 64 * 1024 * 1024
+
+# Bump when the index layout changes, so stale indexes are rejected
+INDEX_VERSION = 2
+
+# Local index used by gm_database.fetch_gm_data (override with SAPIENTIA_OPENING_INDEX)
+OPENING_INDEX_PATH = os.environ.get("SAPIENTIA_OPENING_INDEX", "")
+
+# Results by the index of the winner column: white wins, draws, black wins
+RESULT_CODES = {"1-0": 0, "1/2-1/2": 1, "0-1": 2}
+WINNERS = ("white", None, "black")
+
+# Arrays of the on-disk index, each saved as <name>.npy
+INDEX_ARRAYS = ("hashes", "move_offsets", "moves", "move_results", "move_ratings",
+                "game_offsets", "game_refs", "game_moves", "summary_offsets")
+
+# Game summaries, one JSON line per game; summary_offsets holds the byte offset of each line
+SUMMARIES_FILE = "games.jsonl"
+
+
+def encode_move(move):
+    """Pack a move into 16 bits: from square, to square and promotion piece type."""
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(code):
+    """Unpack a move packed by `encode_move`."""
+    code = int(code)
+    return chess.Move(code & 63, code >> 6 & 63, promotion=(code >> 12) or None)
+
+
+class _OpeningVisitor(chess.pgn.BaseVisitor):
+    """PGN visitor collecting the headers and the (position hash, move) pairs of the first plies of a game."""
+
+    def __init__(self, max_plies):
+        self.max_plies = max_plies
+
+    def begin_game(self):
+        self.headers = {}
+        self.plies = []
+        self.error = None
+
+    def visit_header(self, tagname, tagvalue):
+        self.headers[tagname] = tagvalue
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        if len(self.plies) < self.max_plies:
+            self.plies.append((chess.polyglot.zobrist_hash(board), encode_move(move)))
+
+    def handle_error(self, error):
+        self.error = error
+
+    def result(self):
+        return self
+
+
+def game_summary(headers, game_id):
+    """Return the game reference of the explorer's "topGames" entries (without the move)."""
+    date = headers.get("Date", "")
+    year = date[:4]
+    month = date[:7].replace(".", "-")
+
+    def rating(tag):
+        try:
+            return int(headers.get(tag, 0))
+        except ValueError:
+            return 0
+
+    return {
+        "id": game_id,
+        "winner": WINNERS[RESULT_CODES[headers["Result"]]],
+        "white": {"name": headers.get("White") or "?", "rating": rating("WhiteElo")},
+        "black": {"name": headers.get("Black") or "?", "rating": rating("BlackElo")},
+        "year": int(year) if year.isdigit() else None,
+        "month": month if month[:4].isdigit() and "?" not in month else None,
+    }
+
+
+def split_pgn(path, chunk_bytes=CHUNK_BYTES):
+    """Split a PGN file into (path, start, end) byte ranges that each begin at a game's first tag."""
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, "rb") as f:
+        for offset in range(chunk_bytes, size, chunk_bytes):
+            if offset <= starts[-1]:
+                continue
+            f.seek(offset)
+            f.readline()
+            while True:
+                position = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                if line.startswith(b"[Event "):
+                    starts.append(position)
+                    break
+    return [(path, start, end) for start, end in zip(starts, starts[1:] + [size]) if start < end]
+
+
+def index_pgn_chunk(path, start, end, max_plies=DEFAULT_MAX_PLIES):
+    """
+    Read the games of a PGN byte range and collect their indexed plies.
+
+    Returns:
+        dict: "hashes", "moves", "results" and "games" (the game number within the
+        chunk) arrays with one row per ply, plus "ratings" (average Elo) and "summaries"
+        (see `game_summary`) with one entry per game. Unfinished games are skipped.
+    """
+    hashes, moves, results, games = [], [], [], []
+    ratings, summaries = [], []
+    with open(path, "rb") as f:
+        f.seek(start)
+        pgn = io.StringIO(f.read(end - start).decode("utf-8", errors="replace"))
+    while True:
+        visitor = chess.pgn.read_game(pgn, Visitor=lambda: _OpeningVisitor(max_plies))
+        if visitor is None:
+            break
+        if visitor.error is not None or visitor.headers.get("Result") not in RESULT_CODES or not visitor.plies:
+            continue
+        game = len(summaries)
+        site = visitor.headers.get("Site", "")
+        game_id = site.rsplit("/", 1)[-1] if "/" in site else f"{os.path.basename(path)}:{start}:{game}"
+        summary = game_summary(visitor.headers, game_id)
+        summaries.append(summary)
+        ratings.append((summary["white"]["rating"] + summary["black"]["rating"]) // 2)
+        result = RESULT_CODES[visitor.headers["Result"]]
+        for position_hash, move in visitor.plies:
+            hashes.append(position_hash)
+            moves.append(move)
+            results.append(result)
+            games.append(game)
+    return {
+        "hashes": np.array(hashes, dtype=np.uint64),
+        "moves": np.array(moves, dtype=np.uint16),
+        "results": np.array(results, dtype=np.uint8),
+        "games": np.array(games, dtype=np.uint32),
+        "ratings": np.array(ratings, dtype=np.uint16),
+        "summaries": summaries,
+    }
+
+
+def group_starts(*keys):
+    """Return the indices where any of the (already sorted) key arrays changes value."""
+    changed = np.zeros(len(keys[0]), dtype=bool)
+    if len(changed):
+        changed[0] = True
+    for key in keys:
+        changed[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(changed)
+
+
+def build_index(pgn_paths, output, max_plies=DEFAULT_MAX_PLIES, top_games=DEFAULT_TOP_GAMES,
+                workers=None, chunk_bytes=CHUNK_BYTES):
+    """
+    Build an opening explorer index from PGN files.
+
+    The PGN files are split into chunks that are parsed in parallel on a process
+    pool. The index stores, for every position reached in the first `max_plies`
+    plies, the moves played with their results and average rating, and the
+    references of its `top_games` highest-rated games. Positions are sorted by
+    Zobrist hash, so lookups are a binary search over memory-mapped arrays.
+
+    Args:
+        pgn_paths (list): PGN files to index.
+        output (str): Directory the index is written to; an existing index is replaced.
+        max_plies (int): Number of plies of each game that are indexed.
+        top_games (int): Number of games kept per position.
+        workers (int): Number of worker processes (default: one per core).
+        chunk_bytes (int): Bytes of PGN parsed by one task.
+
+    Returns:
+        dict: The index metadata ("positions", "games", "plies", ...).
+    """
+    chunks = [chunk for path in pgn_paths for chunk in split_pgn(path, chunk_bytes)]
+    parts = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(index_pgn_chunk, path, start, end, max_plies) for path, start, end in chunks]
+        # Keep the chunks in file order, so game numbers are deterministic
+        for future in futures:
+            parts.append(future.result())
+
+    # Number the games of all chunks globally
+    game_base = np.cumsum([0] + [len(part["summaries"]) for part in parts])
+    hashes = np.concatenate([part["hashes"] for part in parts]) if parts else np.zeros(0, np.uint64)
+    moves = np.concatenate([part["moves"] for part in parts]) if parts else np.zeros(0, np.uint16)
+    results = np.concatenate([part["results"] for part in parts]) if parts else np.zeros(0, np.uint8)
+    games = (np.concatenate([part["games"].astype(np.int64) + base for part, base in zip(parts, game_base)])
+             if parts else np.zeros(0, np.int64))
+    ratings = np.concatenate([part["ratings"] for part in parts]) if parts else np.zeros(0, np.uint16)
+    summaries = [summary for part in parts for summary in part["summaries"]]
+    game_ratings = ratings[games].astype(np.int64)
+
+    # Move statistics: one row per (position, move)
+    order = np.lexsort((moves, hashes))
+    hashes, moves, results, games, game_ratings = (
+        hashes[order], moves[order], results[order], games[order], game_ratings[order])
+    starts = group_starts(hashes, moves)
+    move_results = np.zeros((len(starts), 3), dtype=np.uint32)
+    for code in range(3):
+        if len(starts):
+            move_results[:, code] = np.add.reduceat((results == code).astype(np.uint32), starts)
+    counts = np.diff(np.append(starts, len(hashes)))
+    move_ratings = (np.add.reduceat(game_ratings, starts) // counts).astype(np.uint16) if len(starts) else np.zeros(0, np.uint16)
+    move_hashes = hashes[starts]
+    index_moves = moves[starts]
+    position_starts = group_starts(move_hashes)
+    index_hashes = move_hashes[position_starts]
+    move_offsets = np.append(position_starts, len(move_hashes)).astype(np.int64)
+
+    # Top games: one reference per (position, game), since a game may repeat a position
+    order = np.lexsort((games, hashes))
+    unique = order[group_starts(hashes[order], games[order])]
+    # The highest rated games of each position first
+    order = unique[np.lexsort((games[unique], -game_ratings[unique], hashes[unique]))]
+    ref_hashes, ref_games, ref_moves = hashes[order], games[order], moves[order]
+    ref_starts = group_starts(ref_hashes)
+    group_sizes = np.diff(np.append(ref_starts, len(ref_hashes)))
+    rank = np.arange(len(ref_hashes)) - np.repeat(ref_starts, group_sizes)
+    keep = rank < top_games
+    game_offsets = np.append(0, np.cumsum(np.minimum(group_sizes, top_games))).astype(np.int64)
+    game_refs = ref_games[keep].astype(np.uint32)
+    game_moves = ref_moves[keep]
+
+    # Game summaries as JSON lines, so a lookup reads only the games it returns
+    lines = [json.dumps(summary, separators=(",", ":")).encode("utf-8") + b"\n" for summary in summaries]
+    summary_offsets = np.append(0, np.cumsum([len(line) for line in lines], dtype=np.int64)).astype(np.int64)
+
+    arrays = {
+        "hashes": index_hashes,
+        "move_offsets": move_offsets,
+        "moves": index_moves,
+        "move_results": move_results,
+        "move_ratings": move_ratings,
+        "game_offsets": game_offsets,
+        "game_refs": game_refs,
+        "game_moves": game_moves,
+        "summary_offsets": summary_offsets,
+    }
+    meta = {
+        "version": INDEX_VERSION,
+        "max_plies": max_plies,
+        "top_games": top_games,
+        "positions": len(index_hashes),
+        "games": len(summaries),
+        "plies": len(hashes),
+    }
+
+    # Write to a temporary directory first so readers never see a partial index
+    tmp_output = f"{output.rstrip(os.sep)}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_output, ignore_errors=True)
+    os.makedirs(tmp_output)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_output, f"{name}.npy"), array)
+    with open(os.path.join(tmp_output, SUMMARIES_FILE), "wb") as f:
+        f.writelines(lines)
+    with open(os.path.join(tmp_output, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    shutil.rmtree(output, ignore_errors=True)
+    os.replace(tmp_output, output)
+    return meta
+
+
+class OpeningExplorerIndex:
+    """
+    Read-only opening explorer over an index written by `build_index`.
+
+    The arrays and the game summaries are memory-mapped, so opening an index is
+    cheap and lookups only touch the pages they need: a lookup parses just the
+    summaries of the top games it returns.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Opening index {path} has version {self.meta.get('version')}, expected {INDEX_VERSION}")
+        for name in INDEX_ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self._summaries = None
+        self._summaries_lock = threading.Lock()
+
+    def game(self, number):
+        """Return the summary of a game (see `game_summary`), read from the memory-mapped summaries file."""
+        with self._summaries_lock:
+            if self._summaries is None:
+                with open(os.path.join(self.path, SUMMARIES_FILE), "rb") as f:
+                    self._summaries = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start, end = int(self.summary_offsets[number]), int(self.summary_offsets[number + 1])
+        return json.loads(self._summaries[start:end])
+
+    def lookup(self, fen):
+        """
+        Look up a position.
+
+        Args:
+            fen (str or chess.Board): The position.
+
+        Returns:
+            dict: The Lichess explorer response shape: "white", "draws", "black" totals,
+            "moves" (with "uci", "san", "white", "draws", "black", "averageRating"; most
+            played first) and "topGames" (with "uci", "id", "winner", "white", "black",
+            "year", "month"). Both lists are empty for positions that are not indexed.
+        """
+        board = fen if isinstance(fen, chess.Board) else chess.Board(fen)
+        key = np.uint64(chess.polyglot.zobrist_hash(board))
+        row = int(np.searchsorted(self.hashes, key))
+        data = {"white": 0, "draws": 0, "black": 0, "moves": [], "topGames": [], "opening": None}
+        if row == len(self.hashes) or self.hashes[row] != key:
+            return data
+
+        for index in range(self.move_offsets[row], self.move_offsets[row + 1]):
+            move = decode_move(self.moves[index])
+            if move not in board.legal_moves:
+                # Zobrist collision with another position
+                continue
+            white, draws, black = (int(count) for count in self.move_results[index])
+            data["moves"].append({
+                "uci": move.uci(),
+                "san": board.san(move),
+                "averageRating": int(self.move_ratings[index]),
+                "white": white,
+                "draws": draws,
+                "black": black,
+            })
+            data["white"] += white
+            data["draws"] += draws
+            data["black"] += black
+        data["moves"].sort(key=lambda move: -(move["white"] + move["draws"] + move["black"]))
+
+        start, end = self.game_offsets[row], self.game_offsets[row + 1]
+        for game, move in zip(self.game_refs[start:end], self.game_moves[start:end]):
+            data["topGames"].append({"uci": decode_move(move).uci(), **self.game(int(game))})
+        return data
+
+
+_opening_index = None
+_opening_index_lock = threading.Lock()
+
+
+def get_local_explorer(path=None):
+    """Return the index at OPENING_INDEX_PATH (or `path`), opened on first use; None if none is configured."""
+    global _opening_index
+    path = path or OPENING_INDEX_PATH
+    if not path:
+        return None
+    with _opening_index_lock:
+        if _opening_index is None or _opening_index.path != path:
+            _opening_index = OpeningExplorerIndex(path)
+        return _opening_index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query a local opening explorer index from PGN files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Index PGN files")
+    build.add_argument("output", help="Directory to write the index to")
+    build.add_argument("pgn", nargs="+", help="PGN files to index")
+    build.add_argument("--plies", type=int, default=DEFAULT_MAX_PLIES, help="Plies of each game to index")
+    build.add_argument("--top-games", type=int, default=DEFAULT_TOP_GAMES, help="Games kept per position")
+    build.add_argument("--workers", type=int, help="Worker processes (default: one per core)")
+    lookup = subparsers.add_parser("lookup", help="Print the explorer response for a position")
+    lookup.add_argument("index", help="Index directory")
+    lookup.add_argument("fen", nargs="?", default=chess.STARTING_FEN, help="Position in FEN notation")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        meta = build_index(args.pgn, args.output, max_plies=args.plies, top_games=args.top_games, workers=args.workers)
+        print(f"Indexed {meta['positions']} positions from {meta['games']} games into {args.output}")
+    else:
+        print(json.dumps(OpeningExplorerIndex(args.index).lookup(args.fen), indent=2))
+
+
+if __name__ == "__main__":
+    main()
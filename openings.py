@@ -1,14 +1,157 @@
+import os
+import gzip
+import json
+import threading
 import chess
-from datasets import load_dataset
-from IPython.display import display, clear_output, Markdown
+from tracing import span
+
+# Compact local copy of the Lichess openings table, built on first use (override with SAPIENTIA_OPENINGS)
+OPENINGS_ARTIFACT = os.environ.get(
+    "SAPIENTIA_OPENINGS", os.path.join(os.path.expanduser("~"), ".cache", "sapientia", "openings.json.gz"))
+
+# Bump when the artifact layout changes, so stale artifacts are rebuilt
+OPENINGS_ARTIFACT_VERSION = 1
 
 # Global variables for storing move sequences
 uci_sequence = []  # To store moves in UCI notation
 
-# Load the Lichess chess openings dataset
-dset = load_dataset("Lichess/chess-openings")
-train_data = dset['train']
-openings_dict = {entry["name"]: entry["uci"] for entry in train_data}
+class _TrieNode:
+    """A node of the opening move trie: child nodes by UCI move, the openings ending here and the number below it."""
+    __slots__ = ("children", "openings", "count")
+
+    def __init__(self):
+        self.children = {}
+        self.openings = []
+        self.count = 0
+
+class OpeningIndex:
+    """
+    Index of the openings dataset by move sequence and by position.
+
+    The move trie answers "all openings whose moves are a prefix of this game"
+    in time proportional to the game length. The EPD index finds the openings
+    reaching the current position, so transposed move orders still match.
+    Every entry is kept, including openings that share a name. Pass
+    `normalized_epd=True` when the entries' "epd" is already in `normalize_epd` form.
+    """
+
+    def __init__(self, entries, normalized_epd=False):
+        self.root = _TrieNode()
+        self.by_epd = {}
+        for order, entry in enumerate(entries):
+            opening = (order, entry["name"], entry["uci"])
+            node = self.root
+            node.count += 1
+            for move in entry["uci"].split():
+                node = node.children.setdefault(move, _TrieNode())
+                node.count += 1
+            node.openings.append(opening)
+            epd = entry["epd"] if normalized_epd else normalize_epd(entry)
+            self.by_epd.setdefault(epd, []).append(opening)
+
+    def match_moves(self, user_moves):
+        """Return (name, uci) of every opening whose moves are a prefix of `user_moves` (a UCI string)."""
+        matches = list(self.root.openings)
+        node = self.root
+        for move in user_moves.split():
+            node = node.children.get(move)
+            if node is None:
+                break
+            matches.extend(node.openings)
+        return [(name, uci) for _, name, uci in sorted(matches)]
+
+    def continuations(self, user_moves):
+        """
+        Return the UCI moves that continue `user_moves` (a UCI string) into a known opening.
+
+        Moves are ordered by the number of openings that follow them, most popular first.
+        """
+        node = self.root
+        for move in user_moves.split():
+            node = node.children.get(move)
+            if node is None:
+                return []
+        return [move for move, child in sorted(node.children.items(), key=lambda item: -item[1].count)]
+
+    def match_position(self, board):
+        """Return (name, uci) of every opening that reaches the position on `board`."""
+        return [(name, uci) for _, name, uci in self.by_epd.get(board.epd(), [])]
+
+def normalize_epd(entry):
+    """Return the EPD of a dataset entry in python-chess form (en passant only when legal)."""
+    if entry.get("epd"):
+        board, _ = chess.Board.from_epd(entry["epd"])
+    else:
+        board = chess.Board()
+        for move in entry["uci"].split():
+            board.push_uci(move)
+    return board.epd()
+
+def build_openings_artifact(path=OPENINGS_ARTIFACT):
+    """
+    Download the Lichess chess openings dataset and save it as a compact gzipped JSON artifact.
+
+    This is the only place that needs the `datasets` package and network access.
+
+    Returns:
+        list: The opening entries as dicts with "eco", "name", "uci" and normalized "epd".
+    """
+    from datasets import load_dataset
+
+    train_data = load_dataset("Lichess/chess-openings")['train']
+    entries = [
+        {"eco": entry["eco"], "name": entry["name"], "uci": entry["uci"], "epd": normalize_epd(entry)}
+        for entry in train_data
+    ]
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    rows = [[entry["eco"], entry["name"], entry["uci"], entry["epd"]] for entry in entries]
+    # Write to a temporary file first so concurrent readers never see a partial artifact
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump({"version": OPENINGS_ARTIFACT_VERSION, "rows": rows}, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    return entries
+
+def load_openings(path=OPENINGS_ARTIFACT):
+    """Load the opening entries from the local artifact, building it first if it is missing or stale."""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            artifact = json.load(f)
+        if artifact.get("version") == OPENINGS_ARTIFACT_VERSION:
+            return [{"eco": eco, "name": name, "uci": uci, "epd": epd} for eco, name, uci, epd in artifact["rows"]]
+    except (OSError, ValueError):
+        pass
+    return build_openings_artifact(path)
+
+_opening_index = None
+_openings = []
+_openings_lock = threading.Lock()
+
+def get_opening_index():
+    """Return the opening index, loading the openings on first use."""
+    global _opening_index, _openings
+    with _openings_lock:
+        if _opening_index is None:
+            try:
+                _openings = load_openings()
+            except Exception as e:
+                # Keep the GUI usable offline; openings just won't match this session
+                print(f"Error while loading the openings dataset: {e}")
+                _openings = []
+            _opening_index = OpeningIndex(_openings, normalized_epd=True)
+        return _opening_index
+
+def __getattr__(name):
+    """Load `train_data` and `openings_dict` lazily, on first access."""
+    if name == "train_data":
+        get_opening_index()
+        return _openings
+    if name == "openings_dict":
+        get_opening_index()
+        return {entry["name"]: entry["uci"] for entry in _openings}
+    if name == "opening_index":
+        return get_opening_index()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_user_moves(board):
     """Return all moves made on the board as a space-separated UCI string."""
@@ -16,10 +159,17 @@ def get_user_moves(board):
 
 def check_openings(user_moves):
     """Check the openings database for matches with the current user moves."""
-    return [
-        (name, uci) for name, uci in openings_dict.items()
-        if user_moves.startswith(uci)
-    ]
+    with span("openings.check_openings"):
+        return get_opening_index().match_moves(user_moves)
+
+def check_openings_by_position(board):
+    """Check the openings database for openings reaching the current position, in any move order."""
+    with span("openings.check_openings_by_position"):
+        return get_opening_index().match_position(board)
+
+def next_opening_moves(user_moves):
+    """Return the book moves that continue the current user moves, most popular first."""
+    return get_opening_index().continuations(user_moves)
 
 def process_moves(msg, board):
     """Process user moves and update the board."""
@@ -66,3 +216,8 @@ def uci_to_san(uci_moves):
             print(f"Error processing move {move}: {e}")
             break
     return san_moves
+
+if __name__ == "__main__":
+    # Rebuild the openings artifact, e.g. after the dataset was updated
+    entries = build_openings_artifact()
+    print(f"Saved {len(entries)} openings to {OPENINGS_ARTIFACT}")
@@ -0,0 +1,131 @@
+import threading
+import concurrent.futures
+import chess
+from analysis import run_analysis, ANALYSIS_SOURCES, OVERALL_DEADLINE
+from openings import next_opening_moves, get_user_moves
+
+# Number of likely next positions analysed ahead of the user's move
+DEFAULT_MAX_POSITIONS = 3
+
+# Analysis keys whose first UCI token is a candidate next move, in order of preference
+CANDIDATE_KEYS = ("best_move_stockfish", "best_move_komodo", "best_move_uci", "best_move_sapientia", "best_move_syzygy")
+
+
+def candidate_moves(board, data, max_positions=DEFAULT_MAX_POSITIONS):
+    """
+    Return the likeliest next moves after a position was analysed, best first.
+
+    The best moves suggested by the engines, the GM database and the tablebase
+    come first, then book moves that continue a known opening. Only legal moves
+    are returned, without duplicates.
+
+    Args:
+        board (chess.Board): The analysed position, including its move stack.
+        data (dict): The result of `run_analysis` for that position.
+        max_positions (int): Maximum number of moves to return.
+
+    Returns:
+        list: chess.Move objects.
+    """
+    suggestions = []
+    for key in CANDIDATE_KEYS:
+        value = data.get(key)
+        if isinstance(value, str) and value.strip():
+            suggestions.append(value.split()[0])
+    try:
+        suggestions += next_opening_moves(get_user_moves(board))
+    except Exception as e:
+        print(f"Error while looking up opening continuations: {e}")
+
+    moves = []
+    for uci in suggestions:
+        try:
+            move = chess.Move.from_uci(uci)
+        except ValueError:
+            # Placeholders such as "N/A" or "Timed out"
+            continue
+        if move in board.legal_moves and move not in moves:
+            moves.append(move)
+        if len(moves) == max_positions:
+            break
+    return moves
+
+
+class PreAnalysisScheduler:
+    """
+    Analyse the likeliest next positions in the background while the user thinks.
+
+    After the analysis of a position completes, `schedule()` picks candidate moves
+    (see `candidate_moves`) and runs the full analysis of each resulting position,
+    best candidate first, into the shared analysis cache. When the user then plays
+    one of those moves, its analysis is answered from the cache. The speculative
+    work runs on its own small thread pool, so it never holds up the foreground
+    analysis, and `cancel()` stops it as soon as the user moves.
+    """
+
+    def __init__(self, cache, max_positions=DEFAULT_MAX_POSITIONS, deadline=OVERALL_DEADLINE):
+        self.cache = cache
+        self.max_positions = max_positions
+        self.deadline = deadline
+        # One worker per source, so a single position is analysed at a time
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(ANALYSIS_SOURCES), thread_name_prefix="prefetch")
+        self._cancel_event = None
+        self._lock = threading.Lock()
+        self.scheduled = 0
+        self.completed = 0
+
+    def schedule(self, board, data, limit, game=None):
+        """
+        Start pre-analysing the likely replies to a position, cancelling any previous run.
+
+        Args:
+            board (chess.Board): The position that was just analysed.
+            data (dict): Its analysis result, used to pick the candidate moves.
+            limit (chess.engine.Limit): The limit the foreground analysis uses, so the
+                cached engine results match its cache keys.
+            game (object): Key of the game the position belongs to, see `run_analysis`.
+
+        Returns:
+            list: The candidate moves being pre-analysed.
+        """
+        self.cancel()
+        moves = candidate_moves(board, data, self.max_positions)
+        if not moves:
+            return moves
+        cancel_event = threading.Event()
+        with self._lock:
+            self._cancel_event = cancel_event
+        children = []
+        for move in moves:
+            child = board.copy()
+            child.push(move)
+            children.append(child)
+        threading.Thread(target=self._run, args=(children, limit, cancel_event, game), daemon=True).start()
+        return moves
+
+    def _run(self, children, limit, cancel_event, game):
+        for child in children:
+            if cancel_event.is_set():
+                return
+            self.scheduled += 1
+            try:
+                result = run_analysis(child, limit, self.executor, deadline=self.deadline,
+                                      cancel_event=cancel_event, cache=self.cache, game=game)
+            except Exception as e:
+                print(f"Error while pre-analysing {child.fen()}: {e}")
+                continue
+            if not result["cancelled"]:
+                self.completed += 1
+
+    def cancel(self):
+        """Stop the speculative analysis; engine searches in progress stop early."""
+        with self._lock:
+            if self._cancel_event is not None:
+                self._cancel_event.set()
+                self._cancel_event = None
+
+    def shutdown(self):
+        """Cancel any running pre-analysis and release the worker threads."""
+        self.cancel()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,328 @@
+import time
+import chess
+import chess.polyglot
+from incremental import IncrementalEvaluator
+
+# Scores are in centipawns from the side to move's point of view
+MATE_SCORE = 100000
+INFINITY = 1000000
+
+# Scores beyond this are mate scores, which are stored in the transposition table relative to the node
+MATE_THRESHOLD = MATE_SCORE - 1000
+
+# Default maximum number of transposition table entries
+DEFAULT_TT_SIZE = 1 << 20
+
+# Nodes between two checks of the time limit
+TIME_CHECK_INTERVAL = 1024
+
+# Deepest iteration tried when only a time or node limit is given
+MAX_DEPTH = 64
+
+# Transposition table entry flags
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+# Move ordering values for MVV-LVA (most valuable victim, least valuable attacker)
+ORDERING_VALUES = {
+    chess.PAWN: 1,
+    chess.KNIGHT: 3,
+    chess.BISHOP: 3,
+    chess.ROOK: 5,
+    chess.QUEEN: 9,
+    chess.KING: 100,
+}
+
+
+class SearchAborted(Exception):
+    """Raised inside the search when the time or node limit is reached."""
+
+
+class TranspositionTable:
+    """Zobrist-keyed table of search results with a size limit; it is cleared when full."""
+
+    def __init__(self, size=DEFAULT_TT_SIZE):
+        self.size = size
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, entry):
+        if len(self.entries) >= self.size and key not in self.entries:
+            self.entries.clear()
+        self.entries[key] = entry
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SapientiaEngine:
+    """
+    In-process alpha-beta search on the Sapientia material and piece-square terms.
+
+    Principal variation search with iterative deepening, a transposition table,
+    MVV-LVA, killer and history move ordering, check extensions and a
+    quiescence search over captures. Leaf positions are scored with an
+    IncrementalEvaluator, which is updated on every make/unmake.
+    """
+
+    def __init__(self, tt=None):
+        self.tt = tt if tt is not None else TranspositionTable()
+
+    def search(self, board, depth=None, time_limit=None, node_limit=None, info_callback=None, stop_event=None):
+        """
+        Search a position.
+
+        Args:
+            board (chess.Board): The position to search.
+            depth (int): Maximum depth in plies; MAX_DEPTH if only other limits are given.
+            time_limit (float): Seconds after which the search stops.
+            node_limit (int): Number of nodes after which the search stops.
+            info_callback (callable): Called with the info dict after every completed iteration.
+            stop_event (threading.Event): When set, the search stops as if a limit was reached.
+
+        Returns:
+            dict: "move" (UCI or None), "score" (centipawns for the side to move), "depth",
+            "nodes", "time", "nps" and "pv" (list of UCI moves) of the deepest completed iteration.
+        """
+        if depth is None:
+            depth = MAX_DEPTH if time_limit is not None or node_limit is not None else 4
+        self.evaluator = IncrementalEvaluator(board)
+        self.nodes = 0
+        self.start = time.monotonic()
+        self.deadline = self.start + time_limit if time_limit is not None else None
+        self.node_limit = node_limit
+        self.stop_event = stop_event
+        self.killers = {}
+        self.history = {}
+
+        legal_moves = list(board.legal_moves)
+        info = {"move": legal_moves[0].uci() if legal_moves else None, "score": 0, "depth": 0,
+                "nodes": 0, "time": 0.0, "nps": 0, "pv": []}
+        if len(legal_moves) <= 1:
+            return info
+
+        for iteration_depth in range(1, depth + 1):
+            self.root_best = None
+            try:
+                score = self._negamax(iteration_depth, -INFINITY, INFINITY, 0)
+            except SearchAborted:
+                break
+            elapsed = time.monotonic() - self.start
+            info = {
+                "move": self.root_best.uci(),
+                "score": score,
+                "depth": iteration_depth,
+                "nodes": self.nodes,
+                "time": elapsed,
+                "nps": int(self.nodes / elapsed) if elapsed > 0 else 0,
+                "pv": self._principal_variation(board, iteration_depth),
+            }
+            if info_callback is not None:
+                info_callback(info)
+            if abs(score) >= MATE_THRESHOLD:
+                break
+
+        # Report the nodes and time actually spent, including an aborted iteration
+        elapsed = time.monotonic() - self.start
+        info["nodes"] = self.nodes
+        info["time"] = elapsed
+        info["nps"] = int(self.nodes / elapsed) if elapsed > 0 else 0
+        return info
+
+    def _count_node(self):
+        """Count a node and abort the search if a limit is reached."""
+        self.nodes += 1
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchAborted()
+        if self.nodes % TIME_CHECK_INTERVAL == 0:
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                raise SearchAborted()
+            if self.stop_event is not None and self.stop_event.is_set():
+                raise SearchAborted()
+
+    def _evaluate(self):
+        """Static evaluation for the side to move."""
+        score = self.evaluator.material + self.evaluator.position
+        return score if self.evaluator.board.turn == chess.WHITE else -score
+
+    def _capture_value(self, board, move):
+        """MVV-LVA value of a capture."""
+        if board.is_en_passant(move):
+            victim = chess.PAWN
+        else:
+            victim = board.piece_type_at(move.to_square)
+        return ORDERING_VALUES[victim] * 10 - ORDERING_VALUES[board.piece_type_at(move.from_square)]
+
+    def _ordered_moves(self, board, tt_move, ply):
+        """Legal moves ordered by TT move, captures (MVV-LVA), promotions, killers and history."""
+        killers = self.killers.get(ply, ())
+
+        def order(move):
+            if move == tt_move:
+                return 10_000_000
+            if board.is_capture(move):
+                return 1_000_000 + self._capture_value(board, move)
+            if move.promotion:
+                return 900_000 + move.promotion
+            if move in killers:
+                return 800_000 - killers.index(move)
+            return self.history.get((board.turn, move.from_square, move.to_square), 0)
+
+        return sorted(board.legal_moves, key=order, reverse=True)
+
+    def _store_killer(self, move, ply):
+        killers = self.killers.get(ply, [])
+        if move not in killers:
+            self.killers[ply] = [move] + killers[:1]
+
+    def _negamax(self, depth, alpha, beta, ply):
+        board = self.evaluator.board
+        if ply > 0 and (board.is_repetition(2) or board.halfmove_clock >= 100):
+            return 0
+
+        key = chess.polyglot.zobrist_hash(board)
+        entry = self.tt.get(key)
+        tt_move = None
+        if entry is not None:
+            entry_depth, entry_score, entry_flag, tt_move = entry
+            if ply > 0 and entry_depth >= depth:
+                entry_score = from_tt_score(entry_score, ply)
+                if entry_flag == EXACT:
+                    return entry_score
+                if entry_flag == LOWER_BOUND and entry_score >= beta:
+                    return entry_score
+                if entry_flag == UPPER_BOUND and entry_score <= alpha:
+                    return entry_score
+
+        in_check = board.is_check()
+        if in_check:
+            # Check extension
+            depth += 1
+        if depth <= 0:
+            return self._quiescence(alpha, beta, ply)
+
+        self._count_node()
+        moves = self._ordered_moves(board, tt_move, ply)
+        if not moves:
+            return -MATE_SCORE + ply if in_check else 0
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        for index, move in enumerate(moves):
+            self.evaluator.push(move)
+            if index == 0:
+                score = -self._negamax(depth - 1, -beta, -alpha, ply + 1)
+            else:
+                # Null-window search, re-searched with the full window if it improves alpha
+                score = -self._negamax(depth - 1, -alpha - 1, -alpha, ply + 1)
+                if alpha < score < beta:
+                    score = -self._negamax(depth - 1, -beta, -score, ply + 1)
+            self.evaluator.pop()
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if not board.is_capture(move):
+                    self._store_killer(move, ply)
+                    history_key = (board.turn, move.from_square, move.to_square)
+                    self.history[history_key] = self.history.get(history_key, 0) + depth * depth
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self.tt.put(key, (depth, to_tt_score(best_score, ply), flag, best_move))
+        if ply == 0:
+            self.root_best = best_move
+        return best_score
+
+    def _quiescence(self, alpha, beta, ply):
+        """Search captures (or all evasions when in check) until the position is quiet."""
+        self._count_node()
+        board = self.evaluator.board
+
+        if board.is_check():
+            moves = self._ordered_moves(board, None, ply)
+            if not moves:
+                return -MATE_SCORE + ply
+            best_score = -INFINITY
+        else:
+            best_score = self._evaluate()
+            if best_score >= beta:
+                return best_score
+            alpha = max(alpha, best_score)
+            moves = sorted(board.generate_legal_captures(), key=lambda move: self._capture_value(board, move), reverse=True)
+
+        for move in moves:
+            self.evaluator.push(move)
+            score = -self._quiescence(-beta, -alpha, ply + 1)
+            self.evaluator.pop()
+            if score > best_score:
+                best_score = score
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return best_score
+
+    def _principal_variation(self, board, depth):
+        """Follow the transposition table from the root to recover the principal variation."""
+        board = board.copy(stack=False)
+        pv = []
+        for _ in range(depth):
+            entry = self.tt.get(chess.polyglot.zobrist_hash(board))
+            if entry is None or entry[3] is None or entry[3] not in board.legal_moves:
+                break
+            pv.append(entry[3].uci())
+            board.push(entry[3])
+        return pv
+
+
+def to_tt_score(score, ply):
+    """Make mate scores relative to the current node before storing them."""
+    if score >= MATE_THRESHOLD:
+        return score + ply
+    if score <= -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def from_tt_score(score, ply):
+    """Turn a stored mate score back into a score relative to the root."""
+    if score >= MATE_THRESHOLD:
+        return score - ply
+    if score <= -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+# Transposition table shared by all searches in this process
+shared_tt = TranspositionTable()
+
+
+def search_sapientia(fen, depth=3, time_limit=None, node_limit=None, info_callback=None, stop_event=None):
+    """Search a FEN position with the Sapientia engine and return the info dict of `SapientiaEngine.search`."""
+    return SapientiaEngine(tt=shared_tt).search(
+        chess.Board(fen), depth=depth, time_limit=time_limit, node_limit=node_limit,
+        info_callback=info_callback, stop_event=stop_event)
+
+
+def fetch_sapientia_data(fen, depth=3, time_limit=None, node_limit=None):
+    """
+    Fetch the best move for a given FEN position using the in-process Sapientia engine.
+    """
+    try:
+        return search_sapientia(fen, depth=depth, time_limit=time_limit, node_limit=node_limit)["move"]
+    except Exception as e:
+        print(f"Error while fetching best move from Sapientia: {e}")
+        return None
@@ -0,0 +1,321 @@
+import json
+import time
+import argparse
+import threading
+import concurrent.futures
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import chess
+import chess.engine
+from analysis import run_analysis, ANALYSIS_SOURCES, ENGINE_TIMEOUT_MARGIN
+from cache import AnalysisCache
+from engines import get_engine_pool, STOCKFISH_PATH, KOMODO_PATH
+from openings import uci_to_san
+from evaluation import evaluate_material, evaluate_position, evaluate_space_control, evaluate_mobility
+from tracing import Trace, percentile, span, stage_stats, use_trace
+
+# Default address of the analysis service
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Analyses computed at the same time; each one queries every source concurrently
+DEFAULT_WORKERS = 4
+
+# Requests waiting for a worker before new ones are turned away with HTTP 503
+DEFAULT_MAX_QUEUE = 16
+
+# Engine seconds per request when the request gives no depth or time, and the most it may ask for
+DEFAULT_TIME_LIMIT = 2.5
+MAX_TIME_LIMIT = 10.0
+
+# Deepest search a request may ask for
+MAX_DEPTH = 30
+
+# Number of recent requests the latency percentiles are computed over
+LATENCY_WINDOW = 1000
+
+
+class ServiceBusy(Exception):
+    """Raised when the queue of the analysis service is full."""
+
+
+def parse_position(fen=None, moves=None):
+    """
+    Build the board of a request: a FEN, a list or string of UCI moves, or moves played from a FEN.
+
+    Raises:
+        ValueError: If the FEN or a move is invalid or illegal.
+        TypeError: If the FEN, the moves or a move has the wrong type.
+    """
+    if fen is not None and not isinstance(fen, str):
+        raise TypeError(f"The FEN must be a string, not {type(fen).__name__}")
+    board = chess.Board(fen) if fen else chess.Board()
+    if isinstance(moves, str):
+        moves = moves.split()
+    elif moves is not None and not isinstance(moves, list):
+        raise TypeError(f"The moves must be a list or a string, not {type(moves).__name__}")
+    for uci in moves or []:
+        if not isinstance(uci, str):
+            raise TypeError(f"Moves must be UCI strings, not {type(uci).__name__}")
+        move = chess.Move.from_uci(uci)
+        if move not in board.legal_moves:
+            raise ValueError(f"Illegal move: {uci}")
+        board.push(move)
+    return board
+
+
+def parse_limit(depth=None, time_limit=None):
+    """
+    Return the engine limit of a request, capped at MAX_DEPTH plies or MAX_TIME_LIMIT seconds.
+
+    Raises:
+        ValueError: If the depth is below 1 or not a number.
+    """
+    if depth is not None:
+        depth = int(depth)
+        if depth < 1:
+            raise ValueError(f"Depth must be at least 1, not {depth}")
+        return chess.engine.Limit(depth=min(depth, MAX_DEPTH))
+    time_limit = DEFAULT_TIME_LIMIT if time_limit is None else float(time_limit)
+    return chess.engine.Limit(time=min(max(0.1, time_limit), MAX_TIME_LIMIT))
+
+
+class AnalysisService:
+    """
+    Analysis pipeline shared by all clients of the HTTP service.
+
+    Requests run on a bounded pool of `workers` analyses, with at most `max_queue`
+    more waiting; beyond that `analyse()` raises ServiceBusy instead of queueing
+    without limit. Identical requests that arrive while one is being computed wait
+    for that computation instead of starting their own. All requests share the
+    analysis cache and the warm engine pools.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE, cache=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.cache = cache if cache is not None else AnalysisCache()
+        self.request_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="analysis")
+        self.source_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers * len(ANALYSIS_SOURCES), thread_name_prefix="source")
+        # One warm process per engine for each analysis that can run at once
+        for engine_path in (STOCKFISH_PATH, KOMODO_PATH):
+            get_engine_pool(engine_path, size=workers)
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.coalesced = 0
+
+    def analyse(self, board, limit, game=None):
+        """
+        Analyse a position, sharing the computation with identical concurrent requests.
+
+        Requests that name the same `game` reuse the engines' search state; without
+        a game, each request is treated as a new game and engines get "ucinewgame".
+
+        Returns:
+            dict: The fields of the GUI's analysis table (see `_compute`).
+
+        Raises:
+            ServiceBusy: If all workers are busy and the queue is full.
+        """
+        # Requests of different games are not coalesced, so each keeps its own engine search state
+        key = (board.fen(), " ".join(move.uci() for move in board.move_stack), limit.depth, limit.time, game)
+        owner = False
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                if self.queued + self.running >= self.workers + self.max_queue:
+                    self.rejected += 1
+                    raise ServiceBusy(f"{self.queued} requests queued")
+                self.queued += 1
+                game_key = ("game", game) if game is not None else object()
+                future = self.request_executor.submit(self._compute, board.copy(), limit, game_key, time.monotonic())
+                self._inflight[key] = future
+                owner = True
+        if owner:
+            # Outside the lock: the callback runs at once if the analysis already finished
+            future.add_done_callback(lambda _: self._finish(key))
+        return future.result()
+
+    def _finish(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def _compute(self, board, limit, game, submitted):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        trace = Trace()
+        try:
+            with use_trace(trace):
+                fen = board.fen()
+                deadline = (limit.time or MAX_TIME_LIMIT) + ENGINE_TIMEOUT_MARGIN
+                data = run_analysis(board, limit, self.source_executor, deadline=deadline, cache=self.cache,
+                                    trace=trace, game=game)
+                uci_sequence = [move.uci() for move in board.move_stack]
+                with span("server.uci_to_san"):
+                    san_sequence = uci_to_san(uci_sequence) if chess.Board().fen() == board.root().fen() else []
+                with span("server.evaluation"):
+                    evaluation = {
+                        "material": evaluate_material(board),
+                        "position": evaluate_position(board),
+                        "mobility": evaluate_mobility(board),
+                        "space_control": evaluate_space_control(board),
+                    }
+            result = {
+                "fen": fen,
+                "uci_sequence": " ".join(uci_sequence),
+                "san_sequence": " ".join(san_sequence),
+                "evaluation": evaluation,
+                "stage_timings": trace.durations(),
+            }
+            result.update(data)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+        with self._lock:
+            self.completed += 1
+            self._latencies.append(time.monotonic() - submitted)
+        return result
+
+    def stats(self):
+        """Return the queue depth, request counters, latency percentiles, cache stats and per-stage timings."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "coalesced": self.coalesced,
+            }
+        counters["latency"] = {
+            "samples": len(latencies),
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        }
+        counters["cache"] = self.cache.stats()
+        counters["stages"] = stage_stats.summary()
+        return counters
+
+    def shutdown(self):
+        self.request_executor.shutdown(wait=False)
+        self.source_executor.shutdown(wait=False)
+
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON endpoints of the analysis service.
+
+    GET  /analyse?fen=...&moves=e2e4+e7e5&depth=...&time=...&game=...
+    POST /analyse  {"fen": ..., "moves": [...], "depth": ..., "time": ..., "game": ...}
+    GET  /stats
+    """
+
+    service = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/stats":
+            self._send_json(200, self.service.stats())
+        elif url.path == "/analyse":
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            self._analyse(params)
+        else:
+            self._send_json(404, {"error": f"Unknown path: {url.path}"})
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/analyse":
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            params = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._send_json(400, {"error": f"Invalid JSON: {e}"})
+            return
+        if not isinstance(params, dict):
+            self._send_json(400, {"error": "The request body must be a JSON object"})
+            return
+        self._analyse(params)
+
+    def _analyse(self, params):
+        try:
+            board = parse_position(params.get("fen"), params.get("moves"))
+            limit = parse_limit(params.get("depth"), params.get("time"))
+            game = params.get("game")
+            if game is not None and not isinstance(game, (str, int)):
+                raise TypeError(f"The game must be a string or a number, not {type(game).__name__}")
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        try:
+            self._send_json(200, self.service.analyse(board, limit, game))
+        except ServiceBusy as e:
+            self._send_json(503, {"error": f"Service busy: {e}"}, {"Retry-After": "1"})
+        except Exception as e:
+            self._send_json(500, {"error": f"Analysis failed: {e}"})
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the console quiet; /stats reports the traffic
+        pass
+
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, service=None):
+    """Create (but do not start) the HTTP server of an analysis service."""
+    handler = type("Handler", (AnalysisRequestHandler,), {"service": service or AnalysisService()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the Sapientia analysis pipeline over HTTP/JSON.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Analyses computed concurrently")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE, help="Requests queued before HTTP 503")
+    args = parser.parse_args(argv)
+
+    service = AnalysisService(workers=args.workers, max_queue=args.max_queue)
+    server = make_server(args.host, args.port, service)
+    print(f"Serving analysis on http://{args.host}:{server.server_port}/analyse")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
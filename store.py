@@ -0,0 +1,104 @@
+import os
+import sqlite3
+import threading
+import time
+import chess
+
+# Default location of the on-disk analysis store (override with SAPIENTIA_STORE)
+DEFAULT_STORE_PATH = os.environ.get(
+    "SAPIENTIA_STORE", os.path.join(os.path.expanduser("~"), ".cache", "sapientia", "analysis.sqlite3"))
+
+# Seconds a writer waits for another process holding the database lock
+BUSY_TIMEOUT = 30.0
+
+
+def position_epd(fen):
+    """Return the EPD of a FEN, which drops the move counters so transpositions share a key."""
+    return chess.Board(fen).epd()
+
+
+class AnalysisStore:
+    """
+    SQLite-backed store of engine results, keyed by position, engine and depth.
+
+    Only the deepest result per position and engine is kept: a lookup at any
+    depth up to the stored one is answered from disk, and a deeper result
+    replaces a shallower one. The database runs in WAL mode, so several GUI
+    sessions or batch jobs can read and write the same file concurrently.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS engine_results (
+                    epd TEXT NOT NULL,
+                    engine TEXT NOT NULL,
+                    depth INTEGER NOT NULL,
+                    move TEXT NOT NULL,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (epd, engine)
+                )
+            """)
+
+    def _connection(self):
+        """Return this thread's connection; sqlite3 connections cannot be shared across threads."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, fen, engine, depth):
+        """
+        Look up a stored engine result.
+
+        Args:
+            fen (str): The position in FEN notation.
+            engine (str): Name of the engine (e.g. "stockfish").
+            depth (int): The minimum search depth required.
+
+        Returns:
+            dict: {"move", "depth"} of the stored result, or None if nothing at least this deep is stored.
+        """
+        row = self._connection().execute(
+            "SELECT move, depth FROM engine_results WHERE epd = ? AND engine = ? AND depth >= ?",
+            (position_epd(fen), engine, depth)).fetchone()
+        if row is None:
+            return None
+        return {"move": row[0], "depth": row[1]}
+
+    def put(self, fen, engine, depth, move):
+        """Store an engine result, unless a result at least as deep is already stored."""
+        with self._connection() as conn:
+            conn.execute("""
+                INSERT INTO engine_results (epd, engine, depth, move, updated)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (epd, engine) DO UPDATE SET
+                    depth = excluded.depth, move = excluded.move, updated = excluded.updated
+                WHERE excluded.depth > engine_results.depth
+            """, (position_epd(fen), engine, depth, move, time.time()))
+
+    def close(self):
+        """Close this thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_analysis_store():
+    """Return the store at DEFAULT_STORE_PATH, opening it on first use."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = AnalysisStore()
+        return _default_store
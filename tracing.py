@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Number of recent timings per stage the latency percentiles are computed over
+STAGE_WINDOW = 1000
+
+
+def percentile(sorted_values, fraction):
+    """Return the value at `fraction` (0-1) of a sorted list, or None if it is empty."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class StageStats:
+    """Rolling wall-time percentiles and cache/outcome counters for each pipeline stage."""
+
+    def __init__(self, window=STAGE_WINDOW):
+        self.window = window
+        self._timings = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        """Add a finished span's duration, cache result and outcome to its stage."""
+        with self._lock:
+            timings = self._timings.get(span["name"])
+            if timings is None:
+                timings = self._timings[span["name"]] = deque(maxlen=self.window)
+                self._counters[span["name"]] = {}
+            timings.append(span["duration"])
+            counters = self._counters[span["name"]]
+            for key in ("cache", "outcome"):
+                value = span["args"].get(key)
+                if value is not None:
+                    counter = f"{key}_{value}"
+                    counters[counter] = counters.get(counter, 0) + 1
+
+    def summary(self):
+        """Return {stage: {"count", "p50", "p95", "p99", <counters>}} with times in seconds."""
+        with self._lock:
+            stages = {name: (sorted(timings), dict(self._counters[name])) for name, timings in self._timings.items()}
+        return {
+            name: {"count": len(timings), "p50": percentile(timings, 0.50), "p95": percentile(timings, 0.95),
+                   "p99": percentile(timings, 0.99), **counters}
+            for name, (timings, counters) in sorted(stages.items())
+        }
+
+    def clear(self):
+        with self._lock:
+            self._timings.clear()
+            self._counters.clear()
+
+
+# Stage timings of every trace in this process
+stage_stats = StageStats()
+
+
+class Trace:
+    """
+    The timed stages of one request, from any number of threads.
+
+    Spans hold the stage name, start time, wall-time duration, thread and
+    free-form args such as "cache" ("hit"/"miss") and "outcome" ("ok", "error",
+    "timeout", "cancelled"). Every finished span is also added to `stats`.
+    """
+
+    def __init__(self, name="analysis", stats=stage_stats):
+        self.name = name
+        self.stats = stats
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, end, **args):
+        """Record a stage that ran from `start` to `end` (time.perf_counter() values)."""
+        span = {"name": name, "start": start, "duration": end - start, "tid": threading.get_ident(), "args": args}
+        with self._lock:
+            self.spans.append(span)
+        if self.stats is not None:
+            self.stats.record(span)
+        return span
+
+    @contextmanager
+    def span(self, name, **args):
+        """
+        Time the enclosed block as a stage of this trace.
+
+        The yielded dict can be updated with more args (e.g. `args["cache"] = "hit"`).
+        The outcome is "ok", or "error" if the block raises, unless it was set inside.
+        """
+        start = time.perf_counter()
+        try:
+            yield args
+        except GeneratorExit:
+            # A streaming stage whose consumer stopped early
+            args.setdefault("outcome", "stopped")
+            raise
+        except BaseException:
+            args.setdefault("outcome", "error")
+            raise
+        else:
+            args.setdefault("outcome", "ok")
+        finally:
+            self.add_span(name, start, time.perf_counter(), **args)
+
+    def durations(self):
+        """Return the total wall time of each stage in this trace, in seconds, in order of first start."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+        totals = {}
+        for span in spans:
+            totals[span["name"]] = totals.get(span["name"], 0.0) + span["duration"]
+        return totals
+
+    def to_chrome_trace(self):
+        """Return the trace in the Chrome trace event format (chrome://tracing, Perfetto)."""
+        with self._lock:
+            spans = list(self.spans)
+        return {"traceEvents": [
+            {"name": span["name"], "cat": self.name, "ph": "X", "pid": os.getpid(), "tid": span["tid"],
+             "ts": (span["start"] - self.start) * 1e6, "dur": span["duration"] * 1e6, "args": span["args"]}
+            for span in spans
+        ]}
+
+    def export_chrome_trace(self, path):
+        """Write the trace as Chrome trace JSON."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+_current = threading.local()
+
+
+def current_trace():
+    """Return the trace of the request this thread is working on, or None."""
+    return getattr(_current, "trace", None)
+
+
+@contextmanager
+def use_trace(trace):
+    """Make `trace` the current trace of this thread for the enclosed block."""
+    previous = current_trace()
+    _current.trace = trace
+    try:
+        yield trace
+    finally:
+        _current.trace = previous
+
+
+@contextmanager
+def span(name, **args):
+    """Time the enclosed block as a stage of the current trace; does nothing outside a trace."""
+    trace = current_trace()
+    if trace is None:
+        yield args
+    else:
+        with trace.span(name, **args) as span_args:
+            yield span_args